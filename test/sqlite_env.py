@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Shared setup of the sqlite-backed test scripts: the awesome schema in temporary
+sqlite files, an engine on them and a few model factories. No MySQL needed.
+'''
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'www'))
+
+from transwarp import db
+from models import User, Blog, Comment
+
+SCHEMA = '''
+create table users (
+    `id` varchar(50) not null primary key,
+    `email` varchar(50) not null unique,
+    `password` varchar(50) not null,
+    `admin` bool not null,
+    `name` varchar(50) not null,
+    `image` varchar(500) not null,
+    `created_at` real not null
+);
+create table blogs (
+    `id` varchar(50) not null primary key,
+    `user_id` varchar(50) not null,
+    `user_name` varchar(50) not null,
+    `user_image` varchar(500) not null,
+    `name` varchar(50) not null,
+    `summary` varchar(200) not null,
+    `content` mediumtext not null,
+    `created_at` real not null
+);
+create table comments (
+    `id` varchar(50) not null primary key,
+    `blog_id` varchar(50) not null,
+    `user_id` varchar(50) not null,
+    `user_name` varchar(50) not null,
+    `user_image` varchar(500) not null,
+    `content` mediumtext not null,
+    `created_at` real not null
+);
+'''
+
+class CountingConnection(db._SqliteConnection):
+    '''
+    sqlite connection counting rollbacks of all connections.
+    '''
+    rollbacks = 0
+
+    def rollback(self):
+        CountingConnection.rollbacks += 1
+        super(CountingConnection, self).rollback()
+
+db.register_driver('sqlite-test', CountingConnection)
+
+def create_file(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    conn.close()
+    return path
+
+def execute(path, sql, *args):
+    '''
+    Run sql on a db file directly, bypassing the engine, like replication does.
+    '''
+    conn = sqlite3.connect(path)
+    conn.execute(sql, args)
+    conn.commit()
+    conn.close()
+
+def setup_engine(primary, replicas=(), **kw):
+    if db.engine is not None:
+        db.engine.dispose()
+        db.engine = None
+    kw.setdefault('driver', 'sqlite-test')
+    db.create_engine('www-data', 'www-data', primary, replicas=[dict(database=r) for r in replicas], **kw)
+
+@contextlib.contextmanager
+def temp_db(**kw):
+    '''
+    Run the with block on an engine of a new db file, yield the temporary directory of the file.
+    '''
+    tmp = tempfile.mkdtemp()
+    try:
+        setup_engine(create_file(os.path.join(tmp, 'awesome.db')), **kw)
+        yield tmp
+    finally:
+        if db.engine is not None:
+            db.engine.dispose()
+            db.engine = None
+        shutil.rmtree(tmp)
+
+def in_thread(fn, *args):
+    '''
+    Call fn in a new thread, which is not pinned to primary by writes of this thread.
+    '''
+    r = []
+    t = threading.Thread(target=lambda: r.append(fn(*args)))
+    t.start()
+    t.join()
+    return r[0]
+
+def new_user(name):
+    return User(name=name, email='%s@example.com' % name, password='123456', admin=False, image='about:blank')
+
+def new_blog(user, name):
+    return Blog(user_id=user.id, user_name=user.name, user_image=user.image, name=name, summary='summary', content='content')
+
+def new_comment(user, blog, content):
+    return Comment(blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image, content=content)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Async db checks on sqlite, run in this directory: python test_adb.py
+'''
+
+import threading
+
+from sqlite_env import db, temp_db, new_user, new_blog
+from transwarp import adb
+from models import User
+
+def test_adb(user):
+    assert adb.select_int('select count(*) from users').result(5) == db.select_int('select count(*) from users')
+    f = adb.submit(User.get, user.id)
+    assert f.result(5).id == user.id
+    assert f.exception() is None
+
+    def insert_blogs(*names):
+        for name in names:
+            new_blog(user, name).insert()
+        return len(names)
+    assert adb.transaction(insert_blogs, 'async 1', 'async 2').result(5) == 2
+    assert db.select_int('select count(*) from blogs where name like ?', 'async %') == 2
+
+    def insert_and_fail():
+        new_blog(user, 'async 3').insert()
+        raise ValueError('abort')
+    f = adb.transaction(insert_and_fail)
+    assert isinstance(f.exception(5), ValueError)
+    try:
+        f.result()
+        assert False, 'exception not raised'
+    except ValueError:
+        pass
+    assert db.select_int('select count(*) from blogs where name=?', 'async 3') == 0
+
+    done = []
+    f = adb.select('select * from blogs where name like ?', 'async %')
+    f.add_done_callback(lambda fut: done.append(len(fut.result())))
+    n, blogs, u = adb.gather(adb.select_int('select count(*) from blogs'), f, adb.submit(User.get, user.id), timeout=5)
+    assert n == db.select_int('select count(*) from blogs')
+    assert len(blogs) == 2 and u.id == user.id
+    assert done == [2]
+    print 'adb ok'
+
+def test_queue_full():
+    adb.shutdown()
+    adb.init(workers=1, max_queue=1)
+    started = threading.Event()
+    release = threading.Event()
+    def _block():
+        started.set()
+        release.wait(5)
+    f1 = adb.submit(_block)
+    started.wait(5)
+    f2 = adb.submit(_block)
+    f3 = adb.submit(_block)
+    assert isinstance(f3.exception(), adb.QueueFullError)
+    release.set()
+    adb.gather(f1, f2, timeout=5)
+    try:
+        f3.result()
+        assert False, 'exception not raised'
+    except adb.QueueFullError:
+        pass
+    print 'adb queue full ok'
+
+if __name__ == '__main__':
+    with temp_db():
+        test_adb(new_user('michael').insert())
+        test_queue_full()
+        adb.shutdown()
+    print 'ok'
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Identity map checks on sqlite, run in this directory: python test_identity_map.py
+'''
+
+from sqlite_env import db, temp_db, new_user, new_blog
+from transwarp.orm import identity_map
+from models import Blog
+
+def test_identity_map(blog):
+    with identity_map():
+        b1 = Blog.find_first('where id=?', blog.id)
+        assert b1 is Blog.find_first('where id=?', blog.id)
+        bs = Blog.find_by('where id=?', blog.id)
+        assert isinstance(bs, list) and bs[0] is b1
+        # same sql with first=True must not return the list cached by find_by, and vice versa:
+        assert Blog.find_first('where id=?', blog.id) is b1
+        assert isinstance(Blog.find_by('where id=?', blog.id), list)
+        assert Blog.get(blog.id) is b1
+    # a new map loads new instances:
+    with identity_map():
+        assert Blog.get(blog.id) is not b1
+    print 'identity map ok'
+
+def test_invalidate(user, blog):
+    with identity_map():
+        assert len(Blog.find_by('where user_id=?', user.id)) == 1
+        new_blog(user, 'second').insert()
+        assert len(Blog.find_by('where user_id=?', user.id)) == 2
+    print 'identity map invalidation ok'
+
+if __name__ == '__main__':
+    with temp_db():
+        user = new_user('michael').insert()
+        blog = new_blog(user, 'hello').insert()
+        test_identity_map(blog)
+        test_invalidate(user, blog)
+    print 'ok'
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Batched insert checks on sqlite, run in this directory: python test_insert_many.py
+'''
+
+import time
+
+from sqlite_env import db, temp_db, new_user, new_blog, new_comment
+from models import Comment
+
+def test_insert_many(user, blog):
+    rows = [dict(id=db.next_id(), blog_id=blog.id, user_id=user.id, user_name=user.name, user_image=user.image,
+                 content='comment %d' % i, created_at=time.time()) for i in range(250)]
+    assert db.insert_many('comments', rows, batch_size=100) == 250
+    assert db.select_int('select count(*) from comments') == 250
+    assert db.insert_many('comments', []) == 0
+    try:
+        db.insert_many('comments', [dict(id=db.next_id()), dict(content='x')])
+        assert False, 'different columns accepted'
+    except db.DBError:
+        pass
+    # a failing batch in a transaction rolls back the batches before it:
+    rows = [dict(rows[0], id=db.next_id()) for i in range(5)] + [rows[0]]
+    try:
+        with db.transaction():
+            db.insert_many('comments', rows, batch_size=2)
+        assert False, 'duplicate key accepted'
+    except Exception:
+        pass
+    assert db.select_int('select count(*) from comments') == 250
+    print 'insert_many ok'
+
+def test_insert_all(user, blog):
+    comments = [new_comment(user, blog, 'more') for i in range(3)]
+    Comment.insert_all(comments, batch_size=2)
+    assert all(c.id and c.created_at for c in comments)
+    assert sorted(c.id for c in Comment.find_by('where content=?', 'more')) == sorted(c.id for c in comments)
+    print 'insert_all ok'
+
+if __name__ == '__main__':
+    with temp_db():
+        user = new_user('michael').insert()
+        blog = new_blog(user, 'hello').insert()
+        test_insert_many(user, blog)
+        test_insert_all(user, blog)
+    print 'ok'
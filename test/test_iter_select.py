@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Streaming select checks on sqlite, run in this directory: python test_iter_select.py
+'''
+
+import time
+
+from sqlite_env import db, temp_db, new_user, new_blog
+from models import Comment
+
+def insert_comments(user, blog, n):
+    with db.transaction():
+        for i in range(n):
+            db.insert('comments', id=db.next_id(), blog_id=blog.id, user_id=user.id, user_name=user.name,
+                      user_image=user.image, content='comment %d' % i, created_at=time.time() + i)
+
+def test_iter_select(user, blog):
+    insert_comments(user, blog, 250)
+    assert len(list(db.iter_select('select * from comments', chunk=30))) == 250
+    # stop early, the connection goes back to pool and db still works:
+    for c in db.iter_select('select * from comments order by created_at', chunk=10):
+        assert c.content == 'comment 0'
+        break
+    assert db.select_int('select count(*) from comments where blog_id=?', blog.id) == 250
+    assert len(list(Comment.find_iter('where content like ?', 'comment 1%', chunk=7))) == 111
+    # inside a transaction iter_select uses the connection of the transaction:
+    with db.transaction():
+        db.update('update comments set content=? where content=?', 'changed', 'comment 0')
+        assert len(list(db.iter_select('select * from comments where content=?', 'changed'))) == 1
+    print 'iter_select ok'
+
+if __name__ == '__main__':
+    with temp_db():
+        user = new_user('michael').insert()
+        test_iter_select(user, new_blog(user, 'hello').insert())
+    print 'ok'
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Model.get cache checks on sqlite, run in this directory: python test_model_cache.py
+'''
+
+import threading
+
+from sqlite_env import db, temp_db, new_user, in_thread
+from models import User
+from sessions import session_cache
+
+def test_read_through(user):
+    assert User.get(user.id).name == user.name
+    # change the row behind the cache, a cached get does not see it:
+    db.update('update users set image=? where id=?', 'cached', user.id)
+    assert User.get(user.id).image == user.image
+    # update through the model evicts the cache:
+    u = User.get(user.id)
+    u.image = 'updated'
+    u.update()
+    assert User.get(user.id).image == 'updated'
+    # instances do not share the cached values:
+    User.get(user.id).image = 'changed'
+    assert User.get(user.id).image == 'updated'
+    u.delete()
+    assert User.get(user.id) is None
+    print 'model cache ok'
+
+def test_fill_racing_update(user):
+    u = User.get(user.id)
+    User._evict_cached(user.id)
+    read = threading.Event()
+    resume = threading.Event()
+    select_one_row = db.select_one_row
+    def _slow_select_one_row(*args, **kw):
+        r = select_one_row(*args, **kw)
+        read.set()
+        resume.wait(5)
+        return r
+    # a read-through loads the row, then the row is updated before it stores the row:
+    db.select_one_row = _slow_select_one_row
+    try:
+        t = threading.Thread(target=User.get, args=(user.id, ))
+        t.start()
+        read.wait(5)
+    finally:
+        db.select_one_row = select_one_row
+    u.name = 'v2'
+    u.update()
+    resume.set()
+    t.join()
+    assert User.get(user.id).name == 'v2'
+    print 'fill racing update ok'
+
+def test_evict_after_commit(user):
+    u = User.get(user.id)
+    generation = session_cache.generation(user.id)
+    with db.transaction():
+        u.name = 'v3'
+        u.update()
+        # before commit other threads load the old row and cache it:
+        assert in_thread(User.get, user.id).name == 'v2'
+        after_update = session_cache.generation(user.id)
+    assert User.get(user.id).name == 'v3'
+    # sessions cached with the old row are invalidated again:
+    assert after_update > generation
+    assert session_cache.generation(user.id) > after_update
+    # nothing is called after rollback:
+    called = []
+    try:
+        with db.transaction():
+            db.update('update users set name=? where id=?', 'v4', user.id)
+            db.after_commit(called.append, 1)
+            raise ValueError('abort')
+    except ValueError:
+        pass
+    with db.transaction():
+        db.update('update users set name=? where id=?', 'v4', user.id)
+        db.after_commit(called.append, 2)
+        assert called == []
+    assert called == [2]
+    print 'evict after commit ok'
+
+if __name__ == '__main__':
+    with temp_db():
+        test_read_through(new_user('michael').insert())
+        user = new_user('bob').insert()
+        test_fill_racing_update(user)
+        test_evict_after_commit(user)
+    print 'ok'
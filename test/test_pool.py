@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Connection pool checks on sqlite, run in this directory: python test_pool.py
+'''
+
+import threading
+
+from sqlite_env import db, temp_db, new_user, CountingConnection
+
+def test_rollback_on_release():
+    CountingConnection.rollbacks = 0
+    with db.connection():
+        db.update('update users set name=name where admin=?', False)
+    assert CountingConnection.rollbacks == 0, 'committed connection rolled back on release'
+    with db.transaction():
+        db.update('update users set name=name where admin=?', False)
+    assert CountingConnection.rollbacks == 0, 'committed transaction rolled back on release'
+    try:
+        with db.transaction():
+            db.update('update users set name=? where admin=?', 'nobody', False)
+            raise ValueError('abort')
+    except ValueError:
+        pass
+    assert CountingConnection.rollbacks >= 1
+    assert db.select_int('select count(*) from users where name=?', 'nobody') == 0
+    print 'rollback on release ok'
+
+def test_bounded():
+    pool = db.engine._pool
+    held = [db.engine.connect() for i in range(pool.max_size)]
+    errors = []
+    def _acquire():
+        try:
+            db.engine.release(db.engine.connect())
+        except db.PoolTimeoutError, e:
+            errors.append(e)
+    t = threading.Thread(target=_acquire)
+    t.start()
+    t.join()
+    assert len(errors) == 1, 'acquired more than max_size connections'
+    for pc in held:
+        db.engine.release(pc)
+    db.engine.release(db.engine.connect())
+    print 'bounded pool ok'
+
+if __name__ == '__main__':
+    with temp_db(pool_max_size=2, pool_timeout=0.2):
+        new_user('michael').insert()
+        test_rollback_on_release()
+        test_bounded()
+    print 'ok'
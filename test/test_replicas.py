@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Replica routing checks on sqlite files, run in this directory: python test_replicas.py
+'''
+
+import os
+import time
+import shutil
+import sqlite3
+
+from sqlite_env import db, temp_db, create_file, execute, setup_engine, in_thread, new_user, new_blog
+from transwarp import adb
+from models import Blog
+
+def test_replicas(tmp):
+    primary = os.path.join(tmp, 'primary.db')
+    replica = os.path.join(tmp, 'replica.db')
+    create_file(primary)
+    user = new_user('replica')
+    # the replica is a copy of primary taken before the engine starts:
+    setup_engine(primary)
+    db.pin_primary(0)
+    user.insert()
+    blog = new_blog(user, 'v1').insert()
+    db.engine.dispose()
+    shutil.copy(primary, replica)
+    setup_engine(primary, [replica], replica_retry=60.0)
+    db.pin_primary(0)
+
+    # reads go to the replica:
+    execute(replica, 'update blogs set summary=? where id=?', 'from replica', blog.id)
+    assert db.select_one('select * from blogs where id=?', blog.id).summary == 'from replica'
+    with db.read_primary():
+        assert db.select_one('select * from blogs where id=?', blog.id).summary == 'summary'
+    with db.transaction():
+        assert db.select_one('select * from blogs where id=?', blog.id).summary == 'summary'
+
+    # a write pins this thread to primary, other threads still read the lagging replica:
+    b = Blog.get(blog.id)
+    b.name = 'v2'
+    b.update()
+    assert db.primary_pinned_until() > time.time()
+    assert db.select_one('select * from blogs where id=?', blog.id).name == 'v2'
+    assert in_thread(db.select_one, 'select * from blogs where id=?', blog.id).name == 'v1'
+    # but the shared model cache is refilled from primary, whichever thread misses it:
+    assert in_thread(Blog.get, blog.id).name == 'v2'
+
+    # async calls keep the pin of the caller, and pin the caller after writing:
+    assert adb.select_one('select * from blogs where id=?', blog.id).result(5).name == 'v2'
+    db.pin_primary(0)
+    assert adb.select_one('select * from blogs where id=?', blog.id).result(5).name == 'v1'
+    adb.update('update blogs set summary=? where id=?', 'async', blog.id).result(5)
+    assert db.primary_pinned_until() > time.time()
+    db.pin_primary(0)
+
+    # a query failing on the replica is retried on primary, and the replica is marked down:
+    execute(replica, 'drop table comments')
+    assert db.select_int('select count(*) from comments') == 0
+    assert not db.engine.stats()[0].healthy
+    assert db.select_one('select * from blogs where id=?', blog.id).name == 'v2'
+    # a query failing on primary too is not the replica's fault:
+    db.engine._replicas[0].down_until = 0
+    try:
+        db.select('select * from no_such_table')
+        assert False, 'error not raised'
+    except sqlite3.OperationalError:
+        pass
+    assert db.engine.stats()[0].healthy
+    db.engine._replicas[0].down_until = 0
+    assert len(list(db.iter_select('select * from comments'))) == 0
+    assert not db.engine.stats()[0].healthy
+    print 'replicas ok'
+
+if __name__ == '__main__':
+    with temp_db() as tmp:
+        test_replicas(tmp)
+        adb.shutdown()
+    print 'ok'
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+HTTP server checks over a real socket, run in this directory: python test_server.py
+'''
+
+import os
+import sys
+import time
+import signal
+import socket
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'www'))
+
+from transwarp.server import Server
+from transwarp.web import WSGIApplication, get
+
+def raw_app(env, start_response):
+    # a wsgi app dropping the body of HEAD without telling its length:
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    if env['REQUEST_METHOD'] == 'HEAD':
+        return []
+    return ['hello']
+
+@get('/hello')
+def hello():
+    return 'hello'
+
+def web_app():
+    app = WSGIApplication(os.path.dirname(os.path.abspath(__file__)))
+    app.add_url(hello)
+    return app.get_wsgi_application()
+
+def serve(app):
+    '''
+    Serve app in a child process, return (pid, port).
+    '''
+    server = Server(app, port=0, threads=2)
+    server.bind()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            server.serve_forever()
+        finally:
+            os._exit(0)
+    time.sleep(0.3)
+    return pid, server.port
+
+def read_response(sock, head=False):
+    '''
+    Read one response, return (status, headers, body).
+    '''
+    data = ''
+    while '\r\n\r\n' not in data:
+        chunk = sock.recv(4096)
+        assert chunk, 'connection closed before response'
+        data += chunk
+    header, body = data.split('\r\n\r\n', 1)
+    lines = header.split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    length = 0 if head else int(headers.get('Content-Length', 0))
+    while len(body) < length:
+        chunk = sock.recv(4096)
+        assert chunk, 'connection closed in body'
+        body += chunk
+    return lines[0], headers, body
+
+def head_then_get(port, path):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.settimeout(5)
+    try:
+        sock.sendall('HEAD %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % path)
+        status, headers, rest = read_response(sock, head=True)
+        assert status.endswith('200 OK') and rest == '', (status, rest)
+        if headers.get('Connection') == 'close':
+            assert sock.recv(4096) == '', 'connection not closed'
+            return headers, None
+        sock.sendall('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % path)
+        return headers, read_response(sock)
+    finally:
+        sock.close()
+
+def test_head_without_length():
+    pid, port = serve(raw_app)
+    try:
+        headers, next_response = head_then_get(port, '/')
+        assert 'Content-Length' not in headers and headers['Connection'] == 'close', headers
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    print 'head without length ok'
+
+def test_head_keep_alive():
+    pid, port = serve(web_app())
+    try:
+        headers, next_response = head_then_get(port, '/hello')
+        assert headers['Content-Length'] == '5' and headers['Connection'] == 'keep-alive', headers
+        status, headers, body = next_response
+        assert status.endswith('200 OK') and body == 'hello', next_response
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    print 'head keep-alive ok'
+
+if __name__ == '__main__':
+    test_head_without_length()
+    test_head_keep_alive()
+    print 'ok'
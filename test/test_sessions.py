@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Session cache checks on sqlite, run in this directory: python test_sessions.py
+'''
+
+import time
+
+from sqlite_env import temp_db, new_user
+from models import User
+from sessions import SessionCache, session_cache
+
+def test_invalidate(user):
+    generation = session_cache.generation(user.id)
+    u = User.get(user.id)
+    u.update()
+    # the user changed after generation was read, the stale data is not cached:
+    session_cache.put('cookie-1', user.id, 'stale', time.time() + 3600, generation)
+    assert session_cache.get('cookie-1') is None
+    session_cache.put('cookie-1', user.id, 'fresh', time.time() + 3600, session_cache.generation(user.id))
+    assert session_cache.get('cookie-1') == 'fresh'
+    u.update()
+    assert session_cache.get('cookie-1') is None
+    print 'session invalidation ok'
+
+def test_ttl_and_size():
+    cache = SessionCache(max_size=2, ttl=0.1)
+    cache.put('a', 'u1', 'data a', time.time() + 3600)
+    assert cache.get('a') == 'data a'
+    time.sleep(0.2)
+    assert cache.get('a') is None
+    for c in ('a', 'b', 'c'):
+        cache.put(c, 'u1', 'data ' + c, time.time() + 3600)
+    assert cache.get('a') is None and cache.get('c') == 'data c'
+    print 'session ttl and size ok'
+
+if __name__ == '__main__':
+    with temp_db():
+        test_invalidate(new_user('michael').insert())
+        test_ttl_and_size()
+    print 'ok'
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Statement cache checks on sqlite, run in this directory: python test_statement_cache.py
+'''
+
+import os
+
+from sqlite_env import db, temp_db, new_user, setup_engine
+
+class RecordingConnection(db._SqliteConnection):
+    '''
+    sqlite connection recording the keyword arguments of cursor(), which sqlite ignores.
+    '''
+    calls = []
+
+    def cursor(self, **kw):
+        RecordingConnection.calls.append(kw)
+        return super(RecordingConnection, self).cursor(**kw)
+
+db.register_driver('sqlite-recording', RecordingConnection)
+
+def test_hits():
+    sql = 'select count(*) from users where admin=?'
+    db.select_int(sql, False)
+    before = db.statement_cache_stats()
+    for i in range(5):
+        db.select_int(sql, False)
+    after = db.statement_cache_stats()
+    assert after.hits - before.hits == 5, (before, after)
+    assert after.misses == before.misses, (before, after)
+    print 'statement cache hits ok'
+
+def test_prepared_cursor_kwargs(tmp):
+    # mysql.connector raises on a buffered prepared cursor, and connections are buffered by default:
+    setup_engine(os.path.join(tmp, 'awesome.db'), driver='sqlite-recording', prepared_statements=True)
+    del RecordingConnection.calls[:]
+    assert db.select_int('select count(*) from users') == 1
+    prepared = [kw for kw in RecordingConnection.calls if kw.get('prepared')]
+    assert prepared == [dict(prepared=True, buffered=False)], RecordingConnection.calls
+    # not cached, not prepared:
+    setup_engine(os.path.join(tmp, 'awesome.db'), driver='sqlite-recording', prepared_statements=True, statement_cache_size=0)
+    del RecordingConnection.calls[:]
+    assert db.select_int('select count(*) from users') == 1
+    assert not [kw for kw in RecordingConnection.calls if kw.get('prepared')], RecordingConnection.calls
+    print 'prepared cursor kwargs ok'
+
+if __name__ == '__main__':
+    with temp_db() as tmp:
+        new_user('michael').insert()
+        test_hits()
+        test_prepared_cursor_kwargs(tmp)
+    print 'ok'
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+'''
+Web framework checks through a WSGI app, run in this directory: python test_web.py
+'''
+
+import os
+import sys
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'www'))
+
+from transwarp import web
+from transwarp.web import WSGIApplication, Compressor, ctx, get, cached, invalidate_tags, interceptor, seeother
+
+_page = dict(version='v1', invalidate=False)
+
+@cached(300, tags=('page', ))
+@get('/page')
+def page():
+    version = _page['version']
+    if _page['invalidate']:
+        # a writer changes the data and invalidates the page while this request renders it:
+        _page['invalidate'] = False
+        _page['version'] = 'v2'
+        invalidate_tags('page')
+    return version
+
+@get('/files/*')
+def files(path):
+    return 'file %s' % path
+
+def _json(body):
+    etag = '"%s"' % len(body)
+    ctx.response.content_type = 'application/json'
+    ctx.response.set_header('ETag', etag)
+    if ctx.request.not_modified(etag):
+        ctx.response.status = 304
+        return ''
+    return body
+
+@get('/data')
+def data():
+    return _json('[%s]' % ','.join(['1'] * 1000))
+
+@get('/small')
+def small():
+    return _json('[]')
+
+@interceptor('/manage/')
+def manage_interceptor(next):
+    raise seeother('/signin')
+
+def make_app(*funcs, **kw):
+    app = WSGIApplication(os.path.dirname(os.path.abspath(__file__)))
+    for func in kw.get('interceptors', ()):
+        app.add_interceptor(func)
+    app.compressor = kw.get('compressor')
+    for func in funcs:
+        app.add_url(func)
+    return app.get_wsgi_application()
+
+def call(wsgi, method, path, headers=None):
+    env = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'wsgi.input': StringIO(''), 'CONTENT_LENGTH': '0'}
+    env.update(headers or {})
+    out = {}
+    def start_response(status, headers):
+        out['status'] = status
+        out['headers'] = headers
+    body = ''.join(wsgi(env, start_response))
+    return out['status'], dict(out['headers']), body
+
+def test_cached_invalidated_while_rendering():
+    wsgi = make_app(page)
+    assert call(wsgi, 'GET', '/page')[2] == 'v1'
+    assert call(wsgi, 'GET', '/page')[2] == 'v1'
+    invalidate_tags('page')
+    _page['invalidate'] = True
+    assert call(wsgi, 'GET', '/page')[2] == 'v1'
+    # the page rendered before the invalidation is not served:
+    assert call(wsgi, 'GET', '/page')[2] == 'v2'
+    print 'cached invalidated while rendering ok'
+
+def test_catch_all_route():
+    wsgi = make_app(files)
+    assert call(wsgi, 'GET', '/files/a/b.txt')[2] == 'file a/b.txt'
+    assert call(wsgi, 'GET', '/files/c')[2] == 'file c'
+    assert call(wsgi, 'GET', '/other/c')[0].startswith('404')
+    print 'catch-all route ok'
+
+def test_fallback_chain_built_once():
+    wsgi = make_app(files, interceptors=[manage_interceptor])
+    built = []
+    build = web._build_interceptor_chain
+    web._build_interceptor_chain = lambda *args: built.append(args) or build(*args)
+    try:
+        # unmatched paths still run the interceptors:
+        status, headers, body = call(wsgi, 'GET', '/manage/nothing')
+        assert status.startswith('303') and headers['Location'] == '/signin', (status, headers)
+        assert call(wsgi, 'GET', '/nothing')[0].startswith('404')
+        assert call(wsgi, 'GET', '/nothing')[0].startswith('404')
+    finally:
+        web._build_interceptor_chain = build
+    assert built == [], 'interceptor chain built per request'
+    print 'fallback chain ok'
+
+def test_vary_on_not_modified():
+    wsgi = make_app(data, small, compressor=Compressor())
+    gzip = {'HTTP_ACCEPT_ENCODING': 'gzip'}
+    status, headers, body = call(wsgi, 'GET', '/data', gzip)
+    assert headers.get('Content-Encoding') == 'gzip' and headers.get('Vary') == 'Accept-Encoding', headers
+    etag = headers['ETag']
+    status, headers, body = call(wsgi, 'GET', '/data', dict(gzip, HTTP_IF_NONE_MATCH=etag))
+    assert status.startswith('304'), status
+    assert headers.get('Vary') == 'Accept-Encoding', headers
+    # the Vary of a small body does not depend on its size, so its 304 has the same:
+    status, headers, body = call(wsgi, 'GET', '/small', gzip)
+    assert 'Content-Encoding' not in headers and headers.get('Vary') == 'Accept-Encoding', headers
+    status, headers, body = call(wsgi, 'GET', '/small', dict(gzip, HTTP_IF_NONE_MATCH=headers['ETag']))
+    assert status.startswith('304') and headers.get('Vary') == 'Accept-Encoding', (status, headers)
+    print 'vary on not modified ok'
+
+if __name__ == '__main__':
+    test_cached_invalidated_while_rendering()
+    test_catch_all_route()
+    test_fallback_chain_built_once()
+    test_vary_on_not_modified()
+    print 'ok'
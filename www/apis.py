@@ -5,7 +5,7 @@
 JSON API definition.
 '''
 
-import  re, json, logging, functools
+import  re, json, logging, functools, hashlib
 
 from transwarp.web import ctx
 
@@ -23,7 +23,7 @@ class Page(object):
         '''
         self.item_count = item_count
         self.page_size = page_size
-        self.page_count = len(item_count) / page_size + (1 if len(item_count) % page_size > 0 else 0)
+        self.page_count = item_count // page_size + (1 if item_count % page_size > 0 else 0)
         if (item_count == 0) or (page_index < 1) or (page_index > self.page_count):
             self.offset = 0
             self.limit = 0
@@ -40,7 +40,33 @@ class Page(object):
 
     __repr__ = __str__
 
+class CursorPage(object):
+    '''
+    Page object for keyset (cursor) pagination.
+    '''
+
+    def __init__(self, next_cursor=None, page_size=15):
+        '''
+        Init cursor pagination by the cursor of next page and page_size
+        :param next_cursor:
+        :param page_size:
+        '''
+        self.next_cursor = next_cursor
+        self.page_size = page_size
+        self.has_next = next_cursor is not None
+
+    def __str__(self):
+        return 'next_cursor: %s, page_size: %s' % (self.next_cursor, self.page_size)
+
+    __repr__ = __str__
+
 def _dump(obj):
+    if isinstance(obj, CursorPage):
+        return {
+            'next_cursor': obj.next_cursor,
+            'page_size': obj.page_size,
+            'has_next': obj.has_next
+        }
     if isinstance(obj, Page):
         return {
             'page_index': obj.page_index,
@@ -89,6 +115,9 @@ def api(func):
     '''
     A decorator that makes a function to json api, makes the return value as json.
 
+    A GET response carries a strong ETag of the json body, and If-None-Match with
+    the same ETag gets 304 without body.
+
     @app.route('/api/test')
     @api
     def api_test():
@@ -106,6 +135,12 @@ def api(func):
             logging.exception(e)
             r = json.dumps(dict(error='internalerror', data=e.__class__.__name__, message=e.message))
         ctx.response.content_type = 'application/json'
+        if ctx.request.request_method in ('GET', 'HEAD'):
+            etag = '"%s"' % hashlib.md5(r).hexdigest()
+            ctx.response.set_header('ETag', etag)
+            if ctx.request.not_modified(etag):
+                ctx.response.status = 304
+                return ''
         return r
     return _wrapper
 
@@ -11,9 +11,24 @@ configs = {
         'port': 3306,
         'user': 'www-data',
         'password': 'www-data',
-        'database': 'awesome'
+        'database': 'awesome',
+        'replicas': []
     },
     'session': {
-        'secret': 'AwEsOmE'
+        'secret': 'AwEsOmE',
+        'cache_size': 10000,
+        'cache_ttl': 60
+    },
+    'markdown': {
+        'cache_size': 1000,
+        'cache_dir': None
+    },
+    'compression': {
+        'level': 6,
+        'min_size': 1024
+    },
+    'server': {
+        'workers': 0,
+        'threads': 16
     }
 }
\ No newline at end of file
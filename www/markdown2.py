@@ -98,6 +98,7 @@ except ImportError:
 import optparse
 from random import random, randint
 import codecs
+import threading
 
 
 #---- Python version compat
@@ -151,6 +152,19 @@ g_escape_table = dict([(ch, _hash_text(ch))
 class MarkdownError(Exception):
     pass
 
+class MarkdownBatchError(MarkdownError):
+    """Raised by `markdown_many()` when some documents failed to convert.
+
+    `results` holds the html of every document in input order, with None
+    for the failed ones, and `errors` maps the index of each failed
+    document to its error message.
+    """
+    def __init__(self, results, errors):
+        MarkdownError.__init__(self, "%d of %d documents failed to convert"
+                               % (len(errors), len(results)))
+        self.results = results
+        self.errors = errors
+
 
 
 #---- public api
@@ -170,10 +184,241 @@ def markdown_path(path, encoding="utf-8",
 def markdown(text, html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
              safe_mode=None, extras=None, link_patterns=None,
              use_file_vars=False):
-    return Markdown(html4tags=html4tags, tab_width=tab_width,
-                    safe_mode=safe_mode, extras=extras,
-                    link_patterns=link_patterns,
-                    use_file_vars=use_file_vars).convert(text)
+    return _pooled_convert(Markdown, text, html4tags, tab_width, safe_mode,
+                           extras, link_patterns, use_file_vars)
+
+def markdown_incremental(text, html4tags=False, tab_width=DEFAULT_TAB_WIDTH,
+                         safe_mode=None, extras=None, link_patterns=None,
+                         use_file_vars=False):
+    """Like `markdown()`, but re-renders only the top-level blocks that
+    are not in the shared block cache. See `IncrementalMarkdown`.
+    """
+    return _pooled_convert(IncrementalMarkdown, text, html4tags, tab_width,
+                           safe_mode, extras, link_patterns, use_file_vars)
+
+def _pooled_convert(cls, text, html4tags, tab_width, safe_mode, extras,
+                    link_patterns, use_file_vars):
+    key = _converter_pool.key(html4tags, tab_width, safe_mode, extras,
+                              link_patterns, use_file_vars)
+    if key is not None:
+        key = (cls,) + key
+    markdowner = None
+    if key is not None:
+        markdowner = _converter_pool.acquire(key)
+    if markdowner is None:
+        markdowner = cls(html4tags=html4tags, tab_width=tab_width,
+                         safe_mode=safe_mode, extras=extras,
+                         link_patterns=link_patterns,
+                         use_file_vars=use_file_vars)
+    try:
+        return markdowner.convert(text)
+    finally:
+        if key is not None:
+            _converter_pool.release(key, markdowner)
+
+def markdown_many(texts, workers=None, chunksize=None, html4tags=False,
+                  tab_width=DEFAULT_TAB_WIDTH, safe_mode=None, extras=None,
+                  link_patterns=None, use_file_vars=False):
+    """Convert a sequence of documents with a pool of worker processes.
+
+    Conversion is CPU-bound, so documents are sent in chunks to `workers`
+    processes (default: the number of CPUs) to use all cores. The html is
+    returned as a list in input order. A failed document doesn't stop the
+    batch: if any fail, `MarkdownBatchError` is raised once all documents
+    are done, carrying the partial results and per-document errors.
+    """
+    texts = list(texts)
+    options = dict(html4tags=html4tags, tab_width=tab_width,
+                   safe_mode=safe_mode, extras=extras,
+                   link_patterns=link_patterns, use_file_vars=use_file_vars)
+    jobs = [(text, options) for text in texts]
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        outcomes = [_convert_one(job) for job in jobs]
+    else:
+        import multiprocessing
+        if chunksize is None:
+            chunksize = max(1, len(jobs) // (workers * 4))
+        pool = multiprocessing.Pool(workers)
+        try:
+            outcomes = pool.map(_convert_one, jobs, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    results = []
+    errors = {}
+    for i, (ok, value) in enumerate(outcomes):
+        if ok:
+            html, toc, metadata = value
+            html = UnicodeWithAttrs(html)
+            html._toc = toc
+            html.metadata = metadata
+            results.append(html)
+        else:
+            results.append(None)
+            errors[i] = value
+    if errors:
+        raise MarkdownBatchError(results, errors)
+    return results
+
+def _convert_one(job):
+    """Convert one document of `markdown_many()`, in a worker process.
+
+    Returns (True, (html, toc, metadata)) or (False, error message), so a
+    failure is reported for its document instead of aborting the pool.
+    """
+    text, options = job
+    try:
+        html = markdown(text, **options)
+    except Exception:
+        e = sys.exc_info()[1]
+        return False, "%s: %s" % (e.__class__.__name__, e)
+    return True, (unicode(html), html._toc, html.metadata)
+
+def _freeze(obj):
+    """Return a hashable equivalent of the given extras or link patterns."""
+    if isinstance(obj, dict):
+        items = [(k, _freeze(v)) for k, v in obj.items()]
+        items.sort()
+        return tuple(items)
+    if isinstance(obj, (list, tuple)):
+        return tuple([_freeze(o) for o in obj])
+    return obj
+
+class _ConverterPool(object):
+    """A thread-safe pool of reusable `Markdown` instances.
+
+    Building a `Markdown` compiles the tab-width dependent regexes and
+    massages the extras, and `convert()` calls `reset()` anyway, so an
+    instance can be reused for any number of documents. Instances are
+    kept on a free list per option set; a thread checks one out for a
+    single `convert()` call and returns it afterwards, so no instance is
+    ever used by two threads at once.
+    """
+    def __init__(self, max_idle=16, max_keys=64):
+        self.max_idle = max_idle
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._free = {}
+
+    def key(self, html4tags, tab_width, safe_mode, extras, link_patterns,
+            use_file_vars):
+        """Return the pool key of an option set, or None if the options
+        can't be hashed (then the caller should not pool the converter).
+        """
+        if extras and not isinstance(extras, dict):
+            extras = dict([(e, None) for e in extras])
+        key = (bool(html4tags), tab_width, safe_mode, _freeze(extras or {}),
+               _freeze(link_patterns), bool(use_file_vars))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def acquire(self, key):
+        self._lock.acquire()
+        try:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+            return None
+        finally:
+            self._lock.release()
+
+    def release(self, key, markdowner):
+        self._lock.acquire()
+        try:
+            free = self._free.get(key)
+            if free is None:
+                if len(self._free) >= self.max_keys:
+                    return
+                free = self._free[key] = []
+            if len(free) < self.max_idle:
+                free.append(markdowner)
+        finally:
+            self._lock.release()
+
+_converter_pool = _ConverterPool()
+
+class _BlockCache(object):
+    """A thread-safe LRU cache of rendered top-level blocks, shared by all
+    `IncrementalMarkdown` instances.
+
+    Keys embed the md5 of the block source, which may contain html-block
+    placeholders from `_hash_text()`; those are salted per process, so
+    the cache must never be shared between processes.
+
+    Recency is kept in an append-only list of keys (no OrderedDict in
+    older Pythons) that is compacted once it grows to twice `max_size`,
+    dropping the least recently used blocks.
+    """
+    def __init__(self, max_size=5000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._blocks = {}
+        self._order = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        self._lock.acquire()
+        try:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._touch(key)
+            return block
+        finally:
+            self._lock.release()
+
+    def set(self, key, block):
+        self._lock.acquire()
+        try:
+            self._blocks[key] = block
+            self._touch(key)
+        finally:
+            self._lock.release()
+
+    def _touch(self, key):
+        self._order.append(key)
+        if len(self._order) <= self.max_size * 2:
+            return
+        seen = {}
+        order = []
+        for k in reversed(self._order):
+            if k in seen or k not in self._blocks:
+                continue
+            seen[k] = True
+            if len(order) < self.max_size:
+                order.append(k)
+            else:
+                del self._blocks[k]
+        order.reverse()
+        self._order = order
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._blocks.clear()
+            self._order = []
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        self._lock.acquire()
+        try:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._blocks)}
+        finally:
+            self._lock.release()
+
+_block_cache = _BlockCache()
 
 class Markdown(object):
     # The dict of "extras" to enable in processing -- a mapping of
@@ -247,6 +492,8 @@ class Markdown(object):
             self.footnote_ids = []
         if "header-ids" in self.extras:
             self._count_from_header_id = {} # no `defaultdict` in Python 2.4
+        if "toc" in self.extras:
+            self._toc = None
         if "metadata" in self.extras:
             self.metadata = {}
 
@@ -1890,6 +2137,189 @@ class MarkdownWithExtras(Markdown):
     extras = ["footnotes", "code-color"]
 
 
+class IncrementalMarkdown(Markdown):
+    """A markdowner that caches the html of each top-level block.
+
+    The document-wide steps (html block hashing, link and footnote
+    definitions, footnote list, postprocessing) still run over the whole
+    text, but the block gamut runs per top-level block and a block whose
+    source and context are unchanged is taken from the block cache. After
+    an edit to one paragraph of a long document only that paragraph is
+    re-rendered, and the result is the same as `Markdown.convert()`.
+
+    A top-level block is a run of paragraphs that no block construct can
+    span: a new block starts after blank lines at a non-indented line,
+    unless that line continues a list, a blockquote or a fenced code
+    block. Each cached block records what it did to the converter state
+    (footnote refs, TOC entries, header id counts) and is reused only if
+    that state is as it was when it was rendered; the side effects are
+    then replayed. The cache key includes the link definitions and the
+    footnote ids, so editing those re-renders the whole document.
+    """
+    _in_block_gamut = False
+
+    def __init__(self, html4tags=False, tab_width=4, safe_mode=None,
+                 extras=None, link_patterns=None, use_file_vars=False,
+                 block_cache=None):
+        Markdown.__init__(self, html4tags=html4tags, tab_width=tab_width,
+                          safe_mode=safe_mode, extras=extras,
+                          link_patterns=link_patterns,
+                          use_file_vars=use_file_vars)
+        if block_cache is None:
+            block_cache = _block_cache
+        self.block_cache = block_cache
+        if link_patterns:
+            patterns = []
+            for regex, repl in link_patterns:
+                if hasattr(repl, "__call__"):
+                    # Callables can't be compared by value, only share
+                    # blocks rendered by this very instance.
+                    patterns = id(self)
+                    break
+                patterns.append((regex.pattern, regex.flags, repl))
+        else:
+            patterns = None
+        self._options_key = (self.empty_element_suffix, self.tab_width,
+                             self.safe_mode, patterns)
+
+    def _run_block_gamut(self, text):
+        if self._in_block_gamut:
+            # Nested call, e.g. for a list item.
+            return Markdown._run_block_gamut(self, text)
+        self._in_block_gamut = True
+        try:
+            if not text.strip("\n") or ("header-ids" in self.extras
+                    and self._setext_h_re.search(text)
+                    and self._atx_h_re.search(text)):
+                # All setext headers get their ids before all atx headers,
+                # so with both kinds the ids of a block depend on later
+                # blocks too.
+                return Markdown._run_block_gamut(self, text)
+            blocks = self._split_blocks(text)
+            context = repr((self._options_key, _freeze(self.extras),
+                            _freeze(self.urls), _freeze(self.titles),
+                            sorted(getattr(self, "footnotes", {}).keys())))
+            return "\n\n".join([self._run_cached_block(block, context)
+                                 for block in blocks])
+        finally:
+            self._in_block_gamut = False
+
+    _list_start_re = re.compile(r"[ ]{0,3}(?:[%s]|\d+\.)[ \t]" % Markdown._marker_ul_chars)
+    _bq_line_re = re.compile(r"^[ \t]*>", re.M)
+    _pyshell_start_re = re.compile(r"[ ]{0,3}>>>[ ]")
+
+    def _split_blocks(self, text):
+        """Split text into top-level blocks, keeping the separating blank
+        lines with the preceding block so that joining them gives back
+        the text.
+        """
+        # Fenced code blocks are found as `_do_fenced_code_blocks()` will
+        # find them: a "```" that doesn't open one there must not open one
+        # at the start of a block either.
+        fences = None
+        if "fenced-code-blocks" in self.extras and "```" in text:
+            fences = []
+            for match in self._fenced_code_block_re.finditer(text):
+                fence = match.group(0)
+                fences.append((match.end() - len(fence.lstrip("\n")),
+                               match.end()))
+        pyshell = "pyshell" in self.extras
+        blocks = []
+        start = 0       # start of the current block
+        prev = None     # previous paragraph of the current block
+        in_list = False
+        pos = 0
+        for sep in re.finditer(r"\n{2,}", text):
+            graf_start = pos
+            graf = text[pos:sep.start()]
+            pos = sep.end()
+            if not graf:
+                continue
+            if graf[0] in " \t" or (pyshell and self._pyshell_start_re.match(graf)):
+                # Indented: code or continuation of the current block.
+                if self._list_start_re.match(graf):
+                    in_list = True
+            else:
+                # A list goes on over blank lines only with more items.
+                is_item = self._list_start_re.match(graf) is not None
+                joined = prev is None or (is_item and in_list) \
+                    or (graf[0] == ">" and self._bq_line_re.search(prev))
+                if not joined and fences is not None:
+                    for fence_start, fence_end in fences:
+                        if fence_start < graf_start < fence_end:
+                            joined = True
+                            break
+                    else:
+                        joined = graf.startswith("```") and graf_start not in \
+                            [fence_start for fence_start, fence_end in fences]
+                if not joined:
+                    blocks.append(text[start:graf_start])
+                    start = graf_start
+                in_list = is_item
+            prev = graf
+        blocks.append(text[start:])
+        return blocks
+
+    def _run_cached_block(self, text, context):
+        key = md5((context + text).encode("utf-8")).hexdigest()
+        footnote_ids = getattr(self, "footnote_ids", None)
+        counts = getattr(self, "_count_from_header_id", None)
+        block = self.block_cache.get(key)
+        if block is not None and block.usable(footnote_ids, counts):
+            block.replay(self)
+            return block.html
+
+        if footnote_ids is not None:
+            footnote_start = len(footnote_ids)
+        if counts is not None:
+            counts_before = counts.copy()
+        toc_start = self._toc and len(self._toc) or 0
+        html = Markdown._run_block_gamut(self, text)
+
+        block = _RenderedBlock(html)
+        if footnote_ids is not None and len(footnote_ids) > footnote_start:
+            block.footnote_start = footnote_start
+            block.footnote_ids = footnote_ids[footnote_start:]
+        if counts is not None:
+            for id, n in counts.items():
+                if counts_before.get(id) != n:
+                    block.counts.append((id, counts_before.get(id), n))
+        if self._toc and len(self._toc) > toc_start:
+            block.toc = self._toc[toc_start:]
+        self.block_cache.set(key, block)
+        return html
+
+class _RenderedBlock(object):
+    """The html of a top-level block and its effects on the converter."""
+    footnote_start = 0
+    footnote_ids = ()
+    toc = ()
+
+    def __init__(self, html):
+        self.html = html
+        self.counts = []    # [(header id, count before, count after), ...]
+
+    def usable(self, footnote_ids, counts):
+        # Footnote refs are numbered and header ids suffixed by what the
+        # preceding blocks did, so those must be unchanged.
+        if self.footnote_ids and len(footnote_ids) != self.footnote_start:
+            return False
+        for id, before, after in self.counts:
+            if counts.get(id) != before:
+                return False
+        return True
+
+    def replay(self, markdowner):
+        if self.footnote_ids:
+            markdowner.footnote_ids.extend(self.footnote_ids)
+        for id, before, after in self.counts:
+            markdowner._count_from_header_id[id] = after
+        if self.toc:
+            if markdowner._toc is None:
+                markdowner._toc = []
+            markdowner._toc.extend(self.toc)
+
+
 #---- internal support functions
 
 class UnicodeWithAttrs(unicode):
@@ -2214,12 +2644,15 @@ def main(argv=None):
                            "<https://github.com/trentm/python-markdown2/wiki/Extras>")
     parser.add_option("--link-patterns-file",
                       help="path to a link pattern file")
+    parser.add_option("-j", "--jobs", type="int",
+                      help="convert PATHS with this many worker processes")
     parser.add_option("--self-test", action="store_true",
                       help="run internal self-tests (some doctests)")
     parser.add_option("--compare", action="store_true",
                       help="run against Markdown.pl as well (for testing)")
     parser.set_defaults(log_level=logging.INFO, compare=False,
-                        encoding="utf-8", safe_mode=None, use_file_vars=False)
+                        encoding="utf-8", safe_mode=None, use_file_vars=False,
+                        jobs=1)
     opts, paths = parser.parse_args()
     log.setLevel(opts.log_level)
 
@@ -2267,6 +2700,8 @@ def main(argv=None):
                        "Markdown.pl")
     if not paths:
         paths = ['-']
+    if opts.jobs > 1 and not opts.compare:
+        return _main_jobs(paths, opts, extras, link_patterns)
     for path in paths:
         if path == '-':
             text = sys.stdin.read()
@@ -2313,5 +2748,42 @@ def main(argv=None):
             print("==== match? %r ====" % (norm_perl_html == norm_html))
 
 
+def _main_jobs(paths, opts, extras, link_patterns):
+    """Convert `paths` with `markdown_many()` and write the html in order.
+
+    Failed documents are reported on stderr; the exit status is 1 if any
+    failed.
+    """
+    texts = []
+    for path in paths:
+        if path == '-':
+            texts.append(sys.stdin.read())
+        else:
+            fp = codecs.open(path, 'r', opts.encoding)
+            texts.append(fp.read())
+            fp.close()
+    errors = {}
+    try:
+        results = markdown_many(texts, workers=opts.jobs,
+            html4tags=opts.html4tags,
+            safe_mode=opts.safe_mode,
+            extras=extras, link_patterns=link_patterns,
+            use_file_vars=opts.use_file_vars)
+    except MarkdownBatchError:
+        e = sys.exc_info()[1]
+        results, errors = e.results, e.errors
+    for i, html in enumerate(results):
+        if html is None:
+            log.error("%s: %s", paths[i], errors[i])
+            continue
+        if py3:
+            sys.stdout.write(html)
+        else:
+            sys.stdout.write(html.encode(
+                sys.stdout.encoding or "utf-8", 'xmlcharrefreplace'))
+    if errors:
+        return 1
+
+
 if __name__ == "__main__":
     sys.exit( main(sys.argv) )
@@ -6,12 +6,33 @@ Models for usr, blog, comment
 '''
 
 import time, uuid
-from transwarp.db import next_id
+from transwarp.db import next_id, in_transaction, after_commit
 from transwarp.orm import Model, StringField, BooleanField, FloatField, TextField
+from transwarp.cache import LRUCache
+from transwarp.web import invalidate_tags
+from sessions import session_cache
 
+def _invalidate_sessions(user_id):
+    '''
+    Invalidate cached sessions of user, and again after commit: until then other
+    requests still load the old password and cache their sessions with it.
+    '''
+    session_cache.invalidate_user(user_id)
+    if in_transaction():
+        after_commit(session_cache.invalidate_user, user_id)
+
+def _invalidate_pages(*tags):
+    '''
+    Expire cached pages with tags, and again after commit: until then other
+    requests still render the old rows and cache the pages.
+    '''
+    invalidate_tags(*tags)
+    if in_transaction():
+        after_commit(invalidate_tags, *tags)
 
 class User(Model):
     __table__ = 'users'
+    __cache__ = True
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     email = StringField(updatable=False, ddl='varchar(50)')
@@ -21,8 +42,15 @@ class User(Model):
     image = StringField(ddl='varchar(500)')
     created_at = FloatField(updatable=False, default=time.time)
 
+    def post_update(self):
+        _invalidate_sessions(self.id)
+
+    def post_delete(self):
+        _invalidate_sessions(self.id)
+
 class Blog(Model):
     __table__ = 'blogs'
+    __cache__ = LRUCache(max_size=500, ttl=300)
 
     id = StringField(primary_key=True, default=next_id, ddl='varchar(50)')
     user_id = StringField(updatable=False, ddl='varchar(50)')
@@ -30,9 +58,18 @@ class Blog(Model):
     user_image = StringField(ddl='varchar(500)')
     name = StringField(ddl='varchar(50)')
     summary = StringField(ddl='varchar(200)')
-    content = TextField()
+    content = TextField(deferred=True)
     created_at = FloatField(updatable=False, default=time.time)
 
+    def post_insert(self):
+        _invalidate_pages('blog-list')
+
+    def post_update(self):
+        _invalidate_pages('blog:%s' % self.id, 'blog-list')
+
+    def post_delete(self):
+        _invalidate_pages('blog:%s' % self.id, 'blog-list')
+
 class Comment(Model):
     __table__ = 'comments'
 
@@ -43,3 +80,9 @@ class Comment(Model):
     user_image = StringField(ddl='varchar(500)')
     content = TextField()
     created_at = FloatField(updatable=False, default=time.time)
+
+    def post_insert(self):
+        _invalidate_pages('blog:%s' % self.blog_id)
+
+    def post_delete(self):
+        _invalidate_pages('blog:%s' % self.blog_id)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+'''
+Cache of html rendered from markdown, keyed by content hash.
+'''
+
+import os, hashlib, codecs, logging
+
+import markdown2
+from transwarp.cache import LRUCache
+from config import configs
+
+class MarkdownCache(object):
+    '''
+    Render markdown to html with an in-memory LRU cache and an optional disk cache.
+
+    The key is the sha1 of the markdown text, so an edited blog gets a new entry
+    and the stale one is simply evicted later. A miss is converted incrementally,
+    so after an edit only the changed blocks of the document are re-rendered.
+    '''
+
+    def __init__(self, max_size=1000, cache_dir=None):
+        '''
+        Init a MarkdownCache.
+        :param max_size: max number of html documents kept in memory
+        :param cache_dir: directory to persist rendered html, None to disable
+        '''
+        self._memory = LRUCache(max_size, ttl=None)
+        self.cache_dir = cache_dir
+
+    def _key(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return hashlib.sha1(text).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], '%s.html' % key)
+
+    def _load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with codecs.open(self._path(key), 'r', 'utf-8') as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def _save(self, key, html):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp = '%s.%s.tmp' % (path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with codecs.open(tmp, 'w', 'utf-8') as f:
+                f.write(html)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            logging.exception('save rendered html failed:')
+
+    def render(self, text):
+        '''
+        Return html of markdown text, convert it only if not cached.
+        :param text:
+        :return:
+        '''
+        key = self._key(text)
+        html = self._memory.get(key)
+        if html is not None:
+            return html
+        html = self._load(key)
+        if html is None:
+            html = unicode(markdown2.markdown_incremental(text))
+            self._save(key, html)
+        self._memory.set(key, html)
+        return html
+
+    def stats(self):
+        return self._memory.stats()
+
+markdown_cache = MarkdownCache(configs.markdown.cache_size, configs.markdown.cache_dir)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+'''
+Session cache for signed session cookies.
+'''
+
+import time, threading, collections
+
+from config import configs
+
+class SessionCache(object):
+    '''
+    Bounded in-memory cache of verified session cookies.
+
+    Each entry maps a cookie string, whose signature has already been checked,
+    to the user data it identifies. An entry expires with the cookie, but lives
+    at most ttl seconds, because invalidate_user only reaches this process and
+    other worker processes pick up a changed password when the entry expires.
+    Entries are evicted in LRU order and invalidated per user id.
+    '''
+
+    def __init__(self, max_size=10000, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = collections.OrderedDict()
+        self._users = {}
+        self._generations = {}
+
+    def generation(self, user_id):
+        '''
+        Return the invalidation generation of user, read it before loading the user to put.
+        :param user_id:
+        :return:
+        '''
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def get(self, cookie):
+        '''
+        Return cached user data of cookie, or None if not cached or expired.
+        :param cookie:
+        :return:
+        '''
+        with self._lock:
+            entry = self._sessions.pop(cookie, None)
+            if entry is None:
+                return None
+            user_id, data, expires = entry
+            if expires < time.time():
+                self._unlink(cookie, user_id)
+                return None
+            self._sessions[cookie] = entry
+            return data
+
+    def put(self, cookie, user_id, data, expires, generation=0):
+        '''
+        Cache user data of a verified cookie until expires, or for ttl seconds at most.
+        Nothing is cached if the user was invalidated after generation was read,
+        then the data may be loaded before the change.
+        :param cookie:
+        :param user_id:
+        :param data:
+        :param expires:
+        :param generation: value of generation(user_id) read before loading data
+        :return:
+        '''
+        if self.ttl is not None:
+            expires = min(expires, time.time() + self.ttl)
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+            old = self._sessions.pop(cookie, None)
+            if old:
+                self._unlink(cookie, old[0])
+            self._sessions[cookie] = (user_id, data, expires)
+            self._users.setdefault(user_id, set()).add(cookie)
+            while len(self._sessions) > self.max_size:
+                c, entry = self._sessions.popitem(last=False)
+                self._unlink(c, entry[0])
+
+    def invalidate_user(self, user_id):
+        '''
+        Remove all sessions of user, e.g. after the password was changed.
+        :param user_id:
+        :return:
+        '''
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for cookie in self._users.pop(user_id, ()):
+                self._sessions.pop(cookie, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self._users.clear()
+
+    def _unlink(self, cookie, user_id):
+        cookies = self._users.get(user_id)
+        if cookies:
+            cookies.discard(cookie)
+            if not cookies:
+                del self._users[user_id]
+
+session_cache = SessionCache(configs.session.cache_size, configs.session.cache_ttl)
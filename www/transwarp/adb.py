@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+"""
+异步数据库访问
+    Python 2没有asyncio，这里以Future的形式提供db模块的异步版本：
+    1. 语句在专用的db线程中执行，调用方立即得到Future，可以先做别的事情（比如渲染markdown、
+       发起另一个查询），需要结果时再调用result()，也可以用add_done_callback注册回调
+    2. 与db模块相同的?占位符API: select/select_one/select_int/update/insert/insert_many，
+       Model的类方法可以通过submit(Blog.get, id)异步执行
+    3. transaction(fn, *args, **kw)在同一个db线程、同一个事务内执行fn，fn内部照常调用db模块的函数
+    4. 连接来自db.create_engine创建的连接池，驱动由create_engine(driver=...)选择，
+       测试时可以使用sqlite驱动；每个异步调用使用自己的连接，不加入调用方线程中的事务
+    5. 读己之写: db线程沿用调用方线程固定到主库的状态和read_primary()；db线程中写入后，
+       取得结果的线程也固定到主库
+"""
+import sys, time, logging, threading
+import Queue
+
+import db
+
+class QueueFullError(db.DBError):
+    pass
+
+class TimeoutError(db.DBError):
+    pass
+
+class Future(object):
+    '''
+    Result of an async db call.
+    '''
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self.pinned_until = 0
+
+    def done(self):
+        return self._done
+
+    def _wait(self, timeout):
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise TimeoutError('Timeout waiting for db result.')
+
+    def result(self, timeout=None):
+        '''
+        Wait and return the result, or raise the exception of the call.
+        :param timeout: seconds to wait, None to wait forever
+        :return:
+        '''
+        self._wait(timeout)
+        if self.pinned_until > db.primary_pinned_until():
+            db.pin_primary(self.pinned_until)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        '''
+        Wait and return the exception of the call, or None if it succeeded.
+        '''
+        self._wait(timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, fn):
+        '''
+        Call fn(future) when done, in the db thread, or at once if already done.
+        '''
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        self._call(fn)
+
+    def _call(self, fn):
+        try:
+            fn(self)
+        except Exception:
+            logging.exception('error in future callback:')
+
+    def _finish(self, result, exc_info):
+        with self._cond:
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            callbacks = self._callbacks
+            self._callbacks = []
+            self._cond.notify_all()
+        for fn in callbacks:
+            self._call(fn)
+
+    def set_result(self, result):
+        self._finish(result, None)
+
+    def set_exception(self, exc_info):
+        '''
+        :param exc_info: sys.exc_info() of the failed call
+        '''
+        self._finish(None, exc_info)
+
+class _Executor(object):
+    '''
+    Fixed number of db threads running calls from a bounded queue.
+    '''
+    def __init__(self, workers, max_queue):
+        self._queue = Queue.Queue(max_queue)
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work, name='transwarp-db-%d' % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, fn, args, kw, pinned_until, primary = item
+            db.pin_primary(pinned_until)
+            try:
+                if primary:
+                    with db.read_primary():
+                        result = fn(*args, **kw)
+                else:
+                    result = fn(*args, **kw)
+            except Exception:
+                exc_info = sys.exc_info()
+            else:
+                exc_info = None
+            future.pinned_until = db.primary_pinned_until()
+            db.pin_primary(0)
+            if exc_info:
+                future.set_exception(exc_info)
+            else:
+                future.set_result(result)
+
+    def submit(self, fn, *args, **kw):
+        future = Future()
+        try:
+            self._queue.put_nowait((future, fn, args, kw, db.primary_pinned_until(), db.reading_primary()))
+        except Queue.Full:
+            try:
+                raise QueueFullError('Too many pending db calls.')
+            except QueueFullError:
+                future.set_exception(sys.exc_info())
+        return future
+
+    def shutdown(self, wait=True):
+        for t in self._threads:
+            self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+
+_executor = None
+_lock = threading.Lock()
+
+def init(workers=None, max_queue=1000):
+    '''
+    Start db threads, called automatically by the first async call.
+    :param workers: number of db threads, default to the max size of connection pool
+    :param max_queue: max pending calls, more calls fail with QueueFullError
+    :return:
+    '''
+    global _executor
+    with _lock:
+        if _executor is not None:
+            raise db.DBError('adb is already initialized.')
+        if workers is None:
+            workers = db.engine._pool.max_size if db.engine else 10
+        _executor = _Executor(workers, max_queue)
+        logging.info('Init adb with %s db threads ok.' % workers)
+
+def shutdown(wait=True):
+    '''
+    Stop db threads after pending calls are done.
+    '''
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor:
+        executor.shutdown(wait)
+
+def submit(fn, *args, **kw):
+    '''
+    Call fn(*args, **kw) in a db thread, return Future of the result.
+    :param fn:
+    :param args:
+    :param kw:
+    :return:
+    '''
+    if _executor is None:
+        try:
+            init()
+        except db.DBError:
+            # initialized by another thread
+            pass
+    return _executor.submit(fn, *args, **kw)
+
+def select(sql, *args):
+    return submit(db.select, sql, *args)
+
+def select_one(sql, *args):
+    return submit(db.select_one, sql, *args)
+
+def select_int(sql, *args):
+    return submit(db.select_int, sql, *args)
+
+def update(sql, *args):
+    return submit(db.update, sql, *args)
+
+def insert(table, **kw):
+    return submit(db.insert, table, **kw)
+
+def insert_many(table, rows, batch_size=None):
+    return submit(db.insert_many, table, list(rows), batch_size)
+
+def _run_in_transaction(fn, args, kw):
+    with db.transaction():
+        return fn(*args, **kw)
+
+def transaction(fn, *args, **kw):
+    '''
+    Call fn(*args, **kw) in a transaction in a db thread, return Future of the result.
+    The transaction is committed if fn returns, or rolled back if fn raises.
+    :param fn:
+    :param args:
+    :param kw:
+    :return:
+    '''
+    return submit(_run_in_transaction, fn, args, kw)
+
+def gather(*futures, **kw):
+    '''
+    Wait all futures and return list of their results.
+    :param futures:
+    :param timeout: seconds to wait for all futures
+    :return:
+    '''
+    timeout = kw.pop('timeout', None)
+    if timeout is None:
+        return [f.result() for f in futures]
+    deadline = time.time() + timeout
+    return [f.result(max(0.0, deadline - time.time())) for f in futures]
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+"""
+进程内缓存
+    1. CacheBackend: 缓存后端接口，参照memcached的get/set/delete语义，
+       以字符串为key，其他缓存实现（比如memcached客户端）实现同样的接口即可替换
+    2. LRUCache: 线程安全的LRU缓存，同时限制条目数量和存活时间
+    3. LocalMemcache: memcached风格的本地替身，值序列化后保存，取出的是副本
+"""
+import time, threading, collections
+from db import Dict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+class CacheBackend(object):
+    '''
+    Base cache backend.
+    '''
+    def get(self, key):
+        '''
+        Return cached value, or None if not found or expired.
+        :param key:
+        :return:
+        '''
+        return None
+
+    def set(self, key, value, ttl=None):
+        '''
+        Cache value for ttl seconds, use default ttl of backend if ttl is None.
+        :param key:
+        :param value:
+        :param ttl:
+        :return:
+        '''
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        '''
+        Return cache statistics as Dict.
+        :return:
+        '''
+        return Dict()
+
+class LRUCache(CacheBackend):
+    '''
+    Thread-safe LRU cache with size limit and ttl.
+    '''
+    def __init__(self, max_size=1000, ttl=60):
+        '''
+        Init an LRUCache.
+        :param max_size: 最多保存的条目数量，超出时淘汰最久未使用的条目
+        :param ttl: 默认存活秒数，None表示不过期
+        '''
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self._misses += 1
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.time():
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._entries[key] = entry
+            self._hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return Dict(hits=self._hits, misses=self._misses, evictions=self._evictions, expirations=self._expirations, size=len(self._entries))
+
+class LocalMemcache(LRUCache):
+    '''
+    A memcached-like local stand-in, values are stored pickled and every get returns a copy.
+    '''
+    def get(self, key):
+        data = super(LocalMemcache, self).get(key)
+        return None if data is None else pickle.loads(data)
+
+    def set(self, key, value, ttl=None):
+        super(LocalMemcache, self).set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ttl)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 #_*_ coding:utf-8 _*_
+import collections
 import functools
+import itertools
 import logging
+import os
 import threading
 import time
 import uuid
@@ -9,6 +12,12 @@ import uuid
 # global engine object:
 engine = None
 
+# default number of rows per statement in insert_many:
+INSERT_BATCH_SIZE = 500
+
+# default settings of connection pool:
+_POOL_DEFAULTS = dict(min_size=1, max_size=10, timeout=30.0, idle_timeout=600.0, max_lifetime=3600.0, ping=30.0)
+
 def create_engine(user, password, database, host='127.0.0.1', port=3306, **kw):
     """
     db模型的核心函数，用于连接数据库，生成全局对象engine,
@@ -18,23 +27,110 @@ def create_engine(user, password, database, host='127.0.0.1', port=3306, **kw):
     :param database:
     :param host:
     :param port:
-    :param kwargs:
+    :param kwargs: 连接池参数以pool_为前缀，其余参数原样传给mysql.connector:
+        pool_min_size: 空闲回收时至少保留的连接数
+        pool_max_size: 连接数上限，达到上限后取连接需要等待
+        pool_timeout: 取连接的最长等待秒数，超时抛出PoolTimeoutError
+        pool_idle_timeout: 空闲超过该秒数的连接会被关闭
+        pool_max_lifetime: 连接的最长存活秒数，超过后不再复用
+        pool_ping: 空闲超过该秒数的连接在取出时先ping校验，0表示每次都校验，None表示不校验
+        statement_cache_size: 每个连接缓存的语句数量，0表示不缓存
+        prepared_statements: 为True时缓存的语句使用服务端预处理语句执行
+        driver: 数据库驱动的名字，默认为mysql，见register_driver
+        replicas: 只读副本的列表，每一项是覆盖主库连接参数的dict（比如{'host': '10.0.0.2'}）或者主机名，
+            不在事务中的select发往副本，副本的连接池使用与主库相同的参数
+        replica_policy: 选择副本的策略，round_robin轮流使用，least_loaded使用正在使用的连接最少的副本
+        replica_retry: 副本连接失败后暂停使用的秒数，之后再尝试连接
+        read_your_writes: 写入后的该秒数内，当前线程的查询都发往主库，见pin_primary
     :return:
     """
-    import mysql.connector
     global engine
     if engine is not None:
         raise DBError('Engine is already initialized.')
+    driver = kw.pop('driver', 'mysql')
+    if driver not in _drivers:
+        raise DBError('Unknown db driver: %s' % driver)
     params = dict(user=user, password=password, database=database, host=host, port=port)
-    defaults = dict(use_unicode=True, charset='utf8', collation='utf8_general_ci', autocommit=False)
-    for k, v in defaults.iteritems():
-        params[k] = kw.pop(k, v)
+    pool_params = dict()
+    for k, v in _POOL_DEFAULTS.iteritems():
+        pool_params[k] = kw.pop('pool_%s' % k, v)
+    statement_cache_size = kw.pop('statement_cache_size', 128)
+    prepared_statements = kw.pop('prepared_statements', False)
+    replicas = kw.pop('replicas', None) or []
+    replica_policy = kw.pop('replica_policy', 'round_robin')
+    if replica_policy not in ('round_robin', 'least_loaded'):
+        raise DBError('Unknown replica policy: %s' % replica_policy)
+    replica_retry = kw.pop('replica_retry', 30.0)
+    read_your_writes = kw.pop('read_your_writes', 5.0)
     params.update(kw)
-    params['buffered'] = True
-    engine = _Engine(lambda: mysql.connector.connect(**params))
+    connect = _drivers[driver]
+    engine = _Engine(lambda: connect(**params), statement_cache_size, prepared_statements, **pool_params)
+    for r in replicas:
+        if isinstance(r, basestring):
+            r = dict(host=r)
+        replica_params = dict(params, **r)
+        name = '%s:%s' % (replica_params['host'], replica_params['port'])
+        engine.add_replica(_Replica(name, functools.partial(connect, **replica_params), statement_cache_size, prepared_statements, **pool_params))
+    engine.replica_policy = replica_policy
+    engine.replica_retry = replica_retry
+    engine.read_your_writes = read_your_writes
     #logging.info("Engine is None: %s" % (engine is None))
     # test connection...
-    logging.info('Init mysql engine <%s> ok.' % hex(id(engine)))
+    logging.info('Init %s engine <%s> with %s replica(s) ok.' % (driver, hex(id(engine)), len(replicas)))
+
+def register_driver(name, connect):
+    """
+    注册数据库驱动，create_engine(driver=name)时使用
+    :param name:
+    :param connect: connect(user, password, database, host, port, **kw)返回DB-API连接，
+        连接的cursor使用%s占位符，并接受buffered、prepared等关键字参数
+    :return:
+    """
+    _drivers[name] = connect
+
+def _mysql_connect(**params):
+    import mysql.connector
+    defaults = dict(use_unicode=True, charset='utf8', collation='utf8_general_ci', autocommit=False)
+    for k, v in defaults.iteritems():
+        params.setdefault(k, v)
+    params['buffered'] = True
+    return mysql.connector.connect(**params)
+
+class _SqliteCursor(object):
+    """
+    sqlite3 cursor的包装，把%s占位符换回sqlite的?占位符
+    """
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, args=()):
+        self._cursor.execute(sql.replace('%s', '?'), tuple(args))
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+class _SqliteConnection(object):
+    """
+    sqlite驱动，供本地开发和测试使用，database是数据库文件的路径
+    连接池中的每个连接各自打开文件，因此不能使用:memory:数据库
+    """
+    def __init__(self, database, **kw):
+        import sqlite3
+        self._connection = sqlite3.connect(database, check_same_thread=False)
+
+    def cursor(self, **kw):
+        return _SqliteCursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+_drivers = dict(mysql=_mysql_connect, sqlite=_SqliteConnection)
 
 def connection():
     """
@@ -62,6 +158,81 @@ def transaction():
     """
     return _TransactionCtx()
 
+def in_transaction():
+    """
+    当前线程是否处于事务中
+    :return:
+    """
+    return _db_ctx.is_init() and _db_ctx.transactions > 0
+
+def after_commit(fn, *args):
+    """
+    当前线程的事务提交后调用fn(*args)，事务回滚时不调用，不在事务中时立即调用
+    用于清除进程内共享的缓存：提交之前清除的话，其他线程仍会读到旧数据并写回缓存
+    :param fn:
+    :param args:
+    :return:
+    """
+    if in_transaction():
+        _db_ctx.commit_callbacks.append((fn, args))
+    else:
+        fn(*args)
+
+def pin_primary(until):
+    """
+    读己之写：在until时间戳之前，当前线程的查询都发往主库，0表示取消
+    写入后会自动把当前线程固定到主库read_your_writes秒；
+    跨请求（可能由其他进程处理）时，由web层在请求开始时用上次记录的时间戳恢复
+    :param until:
+    :return:
+    """
+    _db_ctx.pinned_until = until
+
+def primary_pinned_until():
+    """
+    返回当前线程固定到主库的截止时间戳，没有固定时返回0
+    :return:
+    """
+    return _db_ctx.pinned_until
+
+def _pin_after_write():
+    if engine is not None and engine.has_replicas():
+        _db_ctx.pinned_until = max(_db_ctx.pinned_until, time.time() + engine.read_your_writes)
+
+def _use_replica():
+    """
+    不在事务中、且没有固定到主库时，查询发往只读副本
+    :return:
+    """
+    return engine.has_replicas() and _db_ctx.transactions == 0 and _db_ctx.primary_reads == 0 \
+        and _db_ctx.pinned_until <= time.time()
+
+def read_primary():
+    """
+    在with语句内，当前线程的查询都发往主库，比如:
+    with read_primary():
+        pass
+    用于回填进程内共享的缓存：写入方清除缓存后，如果从延迟的副本回填，
+    其他请求在缓存有效期内都会读到写入前的数据
+    :return:
+    """
+    return _ReadPrimaryCtx()
+
+def reading_primary():
+    """
+    当前线程是否处于read_primary()中
+    :return:
+    """
+    return _db_ctx.primary_reads > 0
+
+class _ReadPrimaryCtx(object):
+    def __enter__(self):
+        _db_ctx.primary_reads += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _db_ctx.primary_reads -= 1
+
 def with_transaction(func):
     @functools.wraps(func)
     def _wrapper(*args, **kw):
@@ -71,7 +242,6 @@ def with_transaction(func):
         _profiling(start)
     return _wrapper
 
-@with_connection
 def _select(sql, first, *args):
     """
     执行SQL, 返回一个结果或者多个结果组成的列表
@@ -80,23 +250,64 @@ def _select(sql, first, *args):
     :param args:
     :return:
     """
+    return _select_rows(sql, first, args, _dict_factory)
+
+@with_connection
+def _select_rows(sql, first, args, factory):
+    """
+    执行SQL, 每一行数据由factory(列名)返回的构造函数生成
+    :param sql:
+    :param first:
+    :param args:
+    :param factory:
+    :return:
+    """
     global _db_ctx
+    if not _use_replica():
+        return _select_on(_db_ctx.connection, sql, first, args, factory)
+    try:
+        return _select_on(_db_ctx.read_connection, sql, first, args, factory)
+    except Exception:
+        replica = _db_ctx.read_connection.source
+        if _db_ctx.read_connection.connection is None or replica is engine:
+            # failed to connect, or no replica was available and it is the primary failing
+            raise
+        logging.exception('[REPLICA] query on replica %s failed, retry on primary:' % replica.name)
+        _db_ctx.read_connection.cleanup(discard=True)
+    # the error is the replica's only if the primary succeeds:
+    r = _select_on(_db_ctx.connection, sql, first, args, factory)
+    replica.mark_down(engine.replica_retry)
+    return r
+
+def _select_on(_connection, sql, first, args, factory):
+    """
+    在惰性连接_connection上执行查询
+    :param _connection:
+    :param sql:
+    :param first:
+    :param args:
+    :param factory:
+    :return:
+    """
     cursor = None
-    sql = sql.replace('?', '%s')
-    logging.info('SQL: %s, ARGS: %s' % (sql, args))
+    stmt = _connection.statement(sql)
+    logging.info('SQL: %s, ARGS: %s' % (stmt.sql, args))
     try:
-        cursor = _db_ctx.connection.cursor()
-        cursor.execute(sql, args)
+        cursor = stmt.cursor or _connection.cursor()
+        cursor.execute(stmt.sql, args)
         if cursor.description:
-            names = [x[0] for x in cursor.description]
+            make = factory([x[0] for x in cursor.description])
         if first:
             values = cursor.fetchone()
+            if stmt.cursor:
+                # prepared cursor is reused, so drain the rest of result:
+                cursor.fetchall()
             if not values:
                 return None
-            return Dict(names, values)
-        return [Dict(names, x) for x in cursor.fetchall()]
+            return make(values)
+        return [make(x) for x in cursor.fetchall()]
     finally:
-        if cursor:
+        if cursor and cursor is not stmt.cursor:
             cursor.close()
 
 def select_one(sql, *args):
@@ -131,6 +342,100 @@ def select(sql, *args):
     """
     return _select(sql, False, *args)
 
+def select_rows(sql, *args, **kw):
+    """
+    执行sql以列表形式返回结果，每一行是紧凑的Row对象而不是Dict
+    :param sql:
+    :param args:
+    :param factory: 根据列名返回行构造函数，默认为row_type
+    :return:
+    """
+    return _select_rows(sql, False, args, kw.pop('factory', row_type))
+
+def select_one_row(sql, *args, **kw):
+    """
+    执行sql 仅返回一个紧凑的Row对象
+    :param sql:
+    :param args:
+    :param factory: 根据列名返回行构造函数，默认为row_type
+    :return:
+    """
+    return _select_rows(sql, True, args, kw.pop('factory', row_type))
+
+def iter_select(sql, *args, **kw):
+    """
+    执行sql, 以生成器的形式逐行返回结果
+    使用非缓冲的cursor每次fetchmany一批数据，内存占用与结果集大小无关
+    不在事务中时会单独从连接池借用一个连接，因此迭代过程中仍可以执行其他sql；
+    在事务中时使用事务的连接，迭代结束前不能在该连接上执行其他sql
+    :param sql:
+    :param args:
+    :param chunk: 每次从服务端读取的行数，默认1000
+    :param factory: 根据列名返回行构造函数，默认生成Dict，传入row_type可生成紧凑的Row
+    :return:
+    """
+    chunk = kw.pop('chunk', 1000)
+    factory = kw.pop('factory', _dict_factory)
+    if kw:
+        raise TypeError('Unexpected keyword arguments: %s' % ', '.join(kw))
+    global _db_ctx
+    own = not in_transaction()
+    if not own:
+        source, _connection = engine, _db_ctx.connection._connect()
+    elif _use_replica():
+        source, _connection = engine.connect_read()
+    else:
+        source, _connection = engine, engine.connect()
+    cursor = None
+    finished = False
+    sql = sql.replace('?', '%s')
+    logging.info('SQL: %s, ARGS: %s' % (sql, args))
+    try:
+        try:
+            cursor = _connection.cursor(buffered=False)
+            cursor.execute(sql, args)
+        except Exception:
+            if source is engine:
+                raise
+            logging.exception('[REPLICA] query on replica %s failed, retry on primary:' % source.name)
+            replica = source
+            source.release(_connection, discard=True)
+            source, _connection = engine, engine.connect()
+            cursor = _connection.cursor(buffered=False)
+            cursor.execute(sql, args)
+            replica.mark_down(engine.replica_retry)
+        make = factory([x[0] for x in cursor.description])
+        while True:
+            rows = cursor.fetchmany(chunk)
+            if not rows:
+                break
+            for values in rows:
+                yield make(values)
+        finished = True
+    finally:
+        if not finished:
+            finished = _consume_results(_connection)
+        if cursor:
+            cursor.close()
+        if own:
+            source.release(_connection, discard=not finished)
+
+def _consume_results(_connection):
+    """
+    迭代提前结束时读掉服务端未发送完的结果，使连接可以继续使用
+    :param _connection:
+    :return: 连接是否仍然可用
+    """
+    consume = getattr(_connection.connection, 'consume_results', None)
+    if consume is None:
+        return False
+    try:
+        consume()
+        return True
+    except Exception:
+        logging.warning('consume unread result failed.')
+        return False
+
 @with_connection
 def _update(sql, *args):
     """
@@ -141,19 +446,20 @@ def _update(sql, *args):
     """
     global _db_ctx
     cursor = None
-    sql = sql.replace('?', '%s')
-    logging.info('SQL: %s, ARGS: %s' % (sql, args))
+    stmt = _db_ctx.connection.statement(sql)
+    logging.info('SQL: %s, ARGS: %s' % (stmt.sql, args))
     try:
-        cursor = _db_ctx.connection.cursor()
-        cursor.execute(sql, args)
+        cursor = stmt.cursor or _db_ctx.connection.cursor()
+        cursor.execute(stmt.sql, args)
         r = cursor.rowcount
+        _pin_after_write()
         if _db_ctx.transactions == 0:
             #no transaction environment:
             logging.info('auto commit')
             _db_ctx.connection.commit()
         return r
     finally:
-        if cursor:
+        if cursor and cursor is not stmt.cursor:
             cursor.close()
 
 def update(sql, *args):
@@ -176,6 +482,48 @@ def insert(table, **kw):
     sql = 'insert into `%s` (%s) values (%s)' % (table, ','.join(['`%s`' % col for col in cols]), ','.join(['?' for i in range(len(cols))]))
     return _update(sql, *args)
 
+@with_connection
+def insert_many(table, rows, batch_size=None):
+    """
+    批量执行insert语句，每批数据拼成一条多行values的insert，
+    不在事务中时每批提交一次，而不是每行提交一次
+    :param table:
+    :param rows: 字典的序列，所有字典的字段必须相同
+    :param batch_size: 每批的行数，默认为INSERT_BATCH_SIZE
+    :return: 插入的行数
+    """
+    if batch_size is None:
+        batch_size = INSERT_BATCH_SIZE
+    if batch_size < 1:
+        raise ValueError('batch_size must be positive.')
+    rows = iter(rows)
+    cols = None
+    total = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return total
+        if cols is None:
+            cols = tuple(batch[0].iterkeys())
+        args = []
+        for row in batch:
+            if len(row) != len(cols):
+                raise DBError('All rows must have the same columns: %s' % ', '.join(cols))
+            try:
+                args.extend([row[col] for col in cols])
+            except KeyError, e:
+                raise DBError('All rows must have the same columns, missing: %s' % e.args[0])
+        values = '(%s)' % ','.join(['?'] * len(cols))
+        sql = 'insert into `%s` (%s) values %s' % (table, ','.join(['`%s`' % col for col in cols]), ','.join([values] * len(batch)))
+        total += _update(sql, *args)
+
+def statement_cache_stats():
+    """
+    返回所有连接的语句缓存的命中、未命中和淘汰次数
+    :return:
+    """
+    return _statement_stats.snapshot()
+
 class Dict(dict):
     """
     字典对象
@@ -195,6 +543,67 @@ class Dict(dict):
     def __setattr__(self, key, value):
         self[key] = value
 
+def _dict_factory(names):
+    return lambda values: Dict(names, values)
+
+class Row(tuple):
+    """
+    紧凑的行对象
+    以tuple保存一行数据，同一组列名的所有行共享一个列名索引，
+    既可以通过下标访问，也可以通过列名或属性访问，比如 row[0], row['name'], row.name
+    注意Row本身是tuple，序列化成json时是数组，需要对象时请调用as_dict()
+    """
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getattr__(self, key):
+        try:
+            return tuple.__getitem__(self, self._index[key])
+        except KeyError:
+            raise AttributeError(r"'Row' object has no attribute '%s'" % key)
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def keys(self):
+        return list(self._fields)
+
+    def values(self):
+        return list(self)
+
+    def items(self):
+        return zip(self._fields, self)
+
+    def as_dict(self):
+        return Dict(self._fields, self)
+
+    def __repr__(self):
+        return 'Row(%s)' % ', '.join(['%s=%r' % kv for kv in self.items()])
+
+_row_types = {}
+
+def row_type(names):
+    """
+    返回names这组列名对应的Row子类，相同的列名复用同一个类及其列名索引
+    :param names:
+    :return:
+    """
+    names = tuple(names)
+    t = _row_types.get(names)
+    if t is None:
+        if len(_row_types) >= 256:
+            _row_types.clear()
+        index = dict((name, i) for i, name in enumerate(names))
+        t = _row_types[names] = type('Row', (Row, ), dict(__slots__=(), _fields=names, _index=index))
+    return t
+
 def next_id(t=None):
     """
     生成一个唯一id 由当前时间 + 随机数（由伪随机数得来）拼接得到
@@ -225,30 +634,409 @@ class DBError(Exception):
 class MultiColumnsError(DBError):
     pass
 
+class PoolTimeoutError(DBError):
+    pass
+
+class _StatementStats(object):
+    """
+    语句缓存的统计数据，由所有连接的语句缓存共享
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return Dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+_statement_stats = _StatementStats()
+
+class _Statement(object):
+    """
+    缓存的语句: 改写为%s占位符后的sql，以及可选的预处理cursor
+    预处理cursor按sql对象判断是否需要重新prepare，因此sql必须复用同一个字符串对象
+    """
+    __slots__ = ('sql', 'cursor')
+
+    def __init__(self, sql, cursor=None):
+        self.sql = sql
+        self.cursor = cursor
+
+    def close(self):
+        if self.cursor:
+            self.cursor.close()
+            self.cursor = None
+
+class _StatementCache(object):
+    """
+    每个连接一份的LRU语句缓存，以?占位符形式的原始sql为key
+    连接同一时刻只属于一个线程，因此缓存本身不需要加锁
+    """
+    def __init__(self, connection, size=128, prepared=False):
+        self._connection = connection
+        self._size = size
+        self._prepared = prepared
+        self._statements = collections.OrderedDict()
+
+    def get(self, sql):
+        stmt = self._statements.pop(sql, None)
+        if stmt is not None:
+            self._statements[sql] = stmt
+            _statement_stats.incr('hits')
+            return stmt
+        _statement_stats.incr('misses')
+        # an uncached statement would leave its prepared cursor unclosed, so only cached ones are prepared;
+        # mysql.connector has no buffered prepared cursor, so ask for an unbuffered one on the buffered connection:
+        cursor = self._connection.cursor(prepared=True, buffered=False) if self._prepared and self._size > 0 else None
+        stmt = _Statement(sql.replace('?', '%s'), cursor)
+        if self._size > 0:
+            self._statements[sql] = stmt
+            if len(self._statements) > self._size:
+                _, evicted = self._statements.popitem(last=False)
+                evicted.close()
+                _statement_stats.incr('evictions')
+        return stmt
+
+    def clear(self):
+        for stmt in self._statements.itervalues():
+            stmt.close()
+        self._statements.clear()
+
+class _PooledConnection(object):
+    """
+    连接池中的连接对象
+    包装真正的数据库连接，记录连接的创建时间和最后一次归还的时间
+    语句缓存跟随连接保存，连接归还连接池后缓存仍然有效
+    """
+    def __init__(self, connection, statement_cache_size=128, prepared_statements=False):
+        self.connection = connection
+        self.pid = os.getpid()
+        self.created_at = self.last_used = time.time()
+        self.statements = _StatementCache(connection, statement_cache_size, prepared_statements)
+        self.dirty = False
+
+    def cursor(self, **kw):
+        self.dirty = True
+        return self.connection.cursor(**kw)
+
+    def statement(self, sql):
+        self.dirty = True
+        return self.statements.get(sql)
+
+    def commit(self):
+        self.connection.commit()
+        self.dirty = False
+
+    def rollback(self):
+        self.connection.rollback()
+        self.dirty = False
+
+    def in_transaction(self):
+        """
+        连接上是否可能有未结束的事务
+        驱动提供in_transaction属性时以驱动为准，否则只要提交或回滚后执行过语句就认为有
+        :return:
+        """
+        flag = getattr(self.connection, 'in_transaction', None)
+        if isinstance(flag, bool):
+            return flag
+        return self.dirty
+
+    def close(self):
+        try:
+            self.statements.clear()
+        finally:
+            self.connection.close()
+
+class _ConnectionPool(object):
+    """
+    线程安全的有界连接池
+    空闲连接按后进先出的顺序复用，使最近用过的连接保持活跃，长时间空闲的连接则被回收
+    建立和关闭连接都在锁外进行，避免网络操作阻塞其他线程
+    fork之后子进程第一次使用连接池时丢弃从父进程继承的连接（不关闭，以免断开父进程的会话），
+    因此pre-fork的每个worker进程都会建立自己的连接
+    """
+    def __init__(self, connect, min_size=1, max_size=10, timeout=30.0, idle_timeout=600.0, max_lifetime=3600.0, ping=30.0):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise DBError('Invalid pool size: min_size=%s, max_size=%s' % (min_size, max_size))
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping = ping
+        self._idle = collections.deque()
+        self._size = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        """
+        在fork出的子进程中重置连接池，继承来的连接的socket与父进程共享，只能丢弃不能关闭
+        :return:
+        """
+        if self._pid != os.getpid():
+            logging.info('[POOL] process forked, drop %s inherited connection(s).' % self._size)
+            self._idle = collections.deque()
+            self._size = 0
+            self._cond = threading.Condition(threading.Lock())
+            self._pid = os.getpid()
+
+    def _expired(self, pc, now):
+        return self.max_lifetime is not None and now - pc.created_at > self.max_lifetime
+
+    def _collect_stale(self, now):
+        """
+        从空闲队列中取出超过存活时间或空闲时间的连接，调用方需持有锁
+        :param now:
+        :return: 需要在锁外关闭的连接列表
+        """
+        stale = [pc for pc in self._idle if self._expired(pc, now)]
+        if self.idle_timeout is not None:
+            # the oldest idle connections are at the left end:
+            for pc in self._idle:
+                if self._size - len(stale) <= self.min_size or now - pc.last_used <= self.idle_timeout:
+                    break
+                if pc not in stale:
+                    stale.append(pc)
+        for pc in stale:
+            self._idle.remove(pc)
+            self._size -= 1
+        return stale
+
+    def _checkout(self):
+        """
+        在锁内取得一个空闲连接，或者预留一个新建连接的名额
+        :return: (空闲连接或None, 是否预留了新建名额, 需要关闭的过期连接)
+        """
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        with self._cond:
+            while True:
+                stale = self._collect_stale(time.time())
+                if self._idle:
+                    return self._idle.pop(), False, stale
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, True, stale
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise PoolTimeoutError('Timeout waiting for connection: pool size %s exhausted.' % self.max_size)
+                self._cond.wait(remaining)
+
+    def _validate(self, pc):
+        if self.ping is None or time.time() - pc.last_used < self.ping:
+            return True
+        ping = getattr(pc.connection, 'ping', None)
+        if ping is None:
+            return True
+        try:
+            ping()
+            return True
+        except Exception:
+            logging.warning('[POOL] connection <%s> failed validation, discard it.' % hex(id(pc)))
+            return False
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _close(self, pc):
+        try:
+            pc.close()
+        except Exception:
+            logging.exception('[POOL] close connection failed:')
+
+    def acquire(self):
+        """
+        从连接池中取出一个可用连接，必要时新建连接
+        :return:
+        """
+        self._check_pid()
+        while True:
+            pc, reserved, stale = self._checkout()
+            for s in stale:
+                self._close(s)
+            if reserved:
+                try:
+                    pc = self._connect()
+                except:
+                    self._release_slot()
+                    raise
+                logging.info('[POOL] open connection <%s>...' % hex(id(pc)))
+                return pc
+            if self._validate(pc):
+                return pc
+            self._close(pc)
+            self._release_slot()
+
+    def release(self, pc, discard=False):
+        """
+        归还连接，有未结束的事务时先回滚，确保下一个使用者拿到干净的连接，
+        已经提交过的连接不再多一次回滚的往返
+        :param pc:
+        :param discard: 为True时直接关闭连接，不再复用
+        :return:
+        """
+        if pc.pid != os.getpid():
+            # borrowed before fork, the slot belongs to the parent process
+            return
+        if not discard and pc.in_transaction():
+            try:
+                pc.rollback()
+            except Exception:
+                logging.warning('[POOL] reset connection <%s> failed, discard it.' % hex(id(pc)))
+                discard = True
+        now = time.time()
+        if discard or self._expired(pc, now):
+            self._close(pc)
+            self._release_slot()
+            return
+        pc.last_used = now
+        with self._cond:
+            self._idle.append(pc)
+            self._cond.notify()
+
+    def dispose(self):
+        """
+        关闭所有空闲连接，正在使用的连接归还时仍按正常流程处理
+        :return:
+        """
+        self._check_pid()
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for pc in idle:
+            self._close(pc)
+
 class _Engine(object):
     """
     数据库引擎对象
-    用于保存db模块的核心函数: create_engine创建出来的数据库连接
+    用于保存db模块的核心函数: create_engine创建出来的数据库连接池
     """
-    def __init__(self, connect):
-        self._connect = connect
+    def __init__(self, connect, statement_cache_size=128, prepared_statements=False, **kw):
+        self._pool = _ConnectionPool(lambda: _PooledConnection(connect(), statement_cache_size, prepared_statements), **kw)
+        self._replicas = []
+        self._counter = itertools.count()
+        self.replica_policy = 'round_robin'
+        self.replica_retry = 30.0
+        self.read_your_writes = 5.0
+
     def connect(self):
-        return self._connect()
+        return self._pool.acquire()
+
+    def release(self, connection, discard=False):
+        self._pool.release(connection, discard)
+
+    def dispose(self):
+        self._pool.dispose()
+        for r in self._replicas:
+            r.dispose()
+
+    def add_replica(self, replica):
+        self._replicas.append(replica)
+
+    def has_replicas(self):
+        return len(self._replicas) > 0
+
+    def _choose_replica(self):
+        now = time.time()
+        replicas = [r for r in self._replicas if r.down_until <= now]
+        if not replicas:
+            return None
+        start = next(self._counter) % len(replicas)
+        if self.replica_policy == 'least_loaded':
+            replicas = replicas[start:] + replicas[:start]
+            return min(replicas, key=lambda r: r.active)
+        return replicas[start]
+
+    def connect_read(self):
+        """
+        为只读查询取得连接，返回(来源, 连接)，连接用完后通过来源的release归还
+        连接失败的副本暂停使用replica_retry秒，没有可用的副本时使用主库
+        :return:
+        """
+        while True:
+            replica = self._choose_replica()
+            if replica is None:
+                return self, self.connect()
+            try:
+                return replica, replica.connect()
+            except PoolTimeoutError:
+                raise
+            except Exception:
+                logging.exception('[REPLICA] connect to replica %s failed:' % replica.name)
+                replica.mark_down(self.replica_retry)
+
+    def stats(self):
+        """
+        返回各个副本的状态
+        :return:
+        """
+        now = time.time()
+        return [Dict(name=r.name, active=r.active, healthy=r.down_until <= now) for r in self._replicas]
+
+class _Replica(object):
+    """
+    只读副本，持有自己的连接池，记录正在使用的连接数和暂停使用的截止时间
+    """
+    def __init__(self, name, connect, statement_cache_size=128, prepared_statements=False, **kw):
+        self.name = name
+        self._pool = _ConnectionPool(lambda: _PooledConnection(connect(), statement_cache_size, prepared_statements), **kw)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.down_until = 0
+
+    def connect(self):
+        pc = self._pool.acquire()
+        with self._lock:
+            self.active += 1
+        return pc
+
+    def release(self, connection, discard=False):
+        with self._lock:
+            self.active -= 1
+        self._pool.release(connection, discard)
+
+    def mark_down(self, seconds):
+        logging.warning('[REPLICA] replica %s is down, retry after %s seconds.' % (self.name, seconds))
+        self.down_until = time.time() + seconds
+
+    def dispose(self):
+        self._pool.dispose()
 
 class _LasyConnection(object):
     """
     惰性连接对象
-    仅当需要cursor对象时，才连接数据库，获取连接
+    仅当需要cursor对象时，才从连接池取得连接，清理时将连接归还连接池
+    read为True时从只读副本取得连接
     """
-    def __init__(self):
+    def __init__(self, read=False):
         self.connection = None
+        self.read = read
+        self.source = None
 
-    def cursor(self):
+    def _connect(self):
         if self.connection is None:
-            _connection = engine.connect()
-            logging.info('[CONNECTION] [OPEN] connection <%s>...' % hex(id(_connection)))
+            if self.read:
+                self.source, _connection = engine.connect_read()
+            else:
+                self.source, _connection = engine, engine.connect()
+            logging.info('[CONNECTION] [ACQUIRE] connection <%s>...' % hex(id(_connection)))
             self.connection = _connection
-        return self.connection.cursor()
+        return self.connection
+
+    def cursor(self):
+        return self._connect().cursor()
 
     def commit(self):
         self.connection.commit()
@@ -256,12 +1044,20 @@ class _LasyConnection(object):
     def rollback(self):
         self.connection.rollback()
 
-    def cleanup(self):
+    def cleanup(self, discard=False):
         if self.connection:
             _connection = self.connection
             self.connection = None
-            logging.info('[CONNECTION] [CLOSE] connection <%s>...' % hex(id(connection)))
-            _connection.close()
+            logging.info('[CONNECTION] [RELEASE] connection <%s>...' % hex(id(_connection)))
+            self.source.release(_connection, discard)
+
+    def statement(self, sql):
+        """
+        从当前连接的语句缓存中取得sql对应的语句
+        :param sql:
+        :return:
+        """
+        return self._connect().statement(sql)
 
 
 class _DbCtx(threading.local):
@@ -272,7 +1068,11 @@ class _DbCtx(threading.local):
     """
     def __init__(self):
         self.connection = None
+        self.read_connection = None
         self.transactions = 0
+        self.commit_callbacks = []
+        self.pinned_until = 0
+        self.primary_reads = 0
 
     def is_init(self):
         """
@@ -288,15 +1088,21 @@ class _DbCtx(threading.local):
         """
         logging.info('open lazy connection...')
         self.connection = _LasyConnection()
+        self.read_connection = _LasyConnection(read=True)
         self.transactions = 0
+        self.commit_callbacks = []
 
     def cleanup(self):
         """
         清理连接对象，关闭连接
         :return:
         """
-        self.connection.cleanup()
-        self.connection = None
+        try:
+            self.connection.cleanup()
+        finally:
+            self.read_connection.cleanup()
+            self.connection = None
+            self.read_connection = None
 
     def cursor(self):
         """
@@ -361,14 +1167,24 @@ class _TransactionCtx(object):
         _db_ctx.transactions -= 1
         try:
             if _db_ctx.transactions == 0:
+                callbacks = _db_ctx.commit_callbacks
+                _db_ctx.commit_callbacks = []
                 if exc_type is None:
                     self.commit()
+                    self._call(callbacks)
                 else:
                     self.rollback()
         finally:
             if self.should_close_conn:
                 _db_ctx.cleanup()
 
+    def _call(self, callbacks):
+        for fn, args in callbacks:
+            try:
+                fn(*args)
+            except Exception:
+                logging.exception('error in after commit callback:')
+
     def commit(self):
         global  _db_ctx
         logging.info('commit transaction...')
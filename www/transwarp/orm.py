@@ -1,9 +1,16 @@
 #!/usr/bin/env python
 #_*_ coding=utf-8 _*_
 import logging
+import functools
+import itertools
+import threading
+import time
+import json
+import base64
 import db
+from cache import LRUCache
 
-_triggers = frozenset(['pre_insert', 'pre_update', 'pre_delete'])
+_triggers = frozenset(['pre_insert', 'pre_update', 'pre_delete', 'post_insert', 'post_update', 'post_delete'])
 
 def _gen_sql(table_name, mappings):
     """
@@ -26,6 +33,276 @@ def _gen_sql(table_name, mappings):
     sql.append(');')
     return '\n'.join(sql)
 
+def _gen_statements(attrs, mappings, primary_key):
+    """
+    类 ==> 表时 预先生成get/insert/update/delete使用的sql，避免每次调用都重新拼接
+    字段按定义顺序排列，保证同一个类生成的sql始终相同，可以命中db模块的语句缓存
+    :param attrs:
+    :param mappings:
+    :param primary_key:
+    :return:
+    """
+    table = attrs['__table__']
+    pk = primary_key.name
+    fields = sorted(mappings.iteritems(), key=lambda kv: kv[1]._order)
+    insertable = [(k, f) for k, f in fields if f.insertable]
+    updatable = [(k, f) for k, f in fields if f.updatable]
+    attrs['__insertable__'] = insertable
+    attrs['__updatable__'] = updatable
+    deferred = [(k, f) for k, f in fields if f.deferred]
+    attrs['__deferred__'] = frozenset([k for k, f in deferred])
+    attrs['__select_columns__'] = ','.join(['`%s`' % f.name for k, f in fields if not f.deferred]) if deferred else '*'
+    attrs['__select_pk_sql__'] = 'select %s from `%s` where `%s`=?' % (attrs['__select_columns__'], table, pk)
+    attrs['__insert_sql__'] = 'insert into `%s` (%s) values (%s)' % (table, ','.join(['`%s`' % f.name for k, f in insertable]), ','.join(['?'] * len(insertable)))
+    attrs['__update_sql__'] = 'update `%s` set %s where `%s`=?' % (table, ','.join(['`%s`=?' % k for k, f in updatable]), pk)
+    attrs['__delete_sql__'] = 'delete from `%s` where `%s`=?' % (table, pk)
+
+def encode_cursor(values):
+    """
+    将分页位置（排序字段和主键的值）编码成不透明的游标字符串
+    :param values:
+    :return:
+    """
+    return base64.urlsafe_b64encode(json.dumps(list(values))).rstrip('=')
+
+def decode_cursor(token):
+    """
+    解码encode_cursor生成的游标字符串，格式不正确时抛出ValueError
+    :param token:
+    :return:
+    """
+    try:
+        token = str(token)
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor: %s' % token)
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError('Invalid cursor: %s' % token)
+    return tuple(values)
+
+_COUNT_ALL = ('*', )
+_COUNT_APPROXIMATE = ('~', )
+
+class _CountCache(object):
+    """
+    各个Model共享的计数缓存，按表保存 key => [计数, 过期时间]
+    key为_COUNT_ALL、_COUNT_APPROXIMATE或者 (where, args)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tables = {}
+
+    def get(self, table, key):
+        with self._lock:
+            entry = self._tables.get(table, {}).get(key)
+            if entry and entry[1] > time.time():
+                return entry[0]
+            return None
+
+    def set(self, table, key, value, ttl):
+        with self._lock:
+            self._tables.setdefault(table, {})[key] = [value, time.time() + ttl]
+
+    def adjust(self, table, delta):
+        """
+        insert/delete之后更新计数: 总数直接加减，带条件的计数无法判断是否受影响，直接失效
+        :param table:
+        :param delta:
+        :return:
+        """
+        with self._lock:
+            entries = self._tables.get(table)
+            if not entries:
+                return
+            kept = dict([(k, entries[k]) for k in (_COUNT_ALL, _COUNT_APPROXIMATE) if k in entries])
+            for entry in kept.itervalues():
+                entry[0] = max(0, entry[0] + delta)
+            self._tables[table] = kept
+
+    def invalidate(self, table):
+        with self._lock:
+            self._tables.pop(table, None)
+
+_counts = _CountCache()
+
+def _count_changed(table, delta):
+    """
+    表的行数发生变化，事务中的修改可能被回滚，因此只能让计数失效
+    :param table:
+    :param delta:
+    :return:
+    """
+    if db.in_transaction():
+        _counts.invalidate(table)
+    elif delta:
+        _counts.adjust(table, delta)
+
+class _IdentityMap(threading.local):
+    """
+    线程内的身份映射（identity map），开启后同一主键的记录在本线程只对应一个实例，
+    相同的find_*查询直接返回已经加载的实例，insert/update/delete会使查询结果失效
+    """
+    def __init__(self):
+        self.instances = None
+        self.queries = None
+
+    def is_init(self):
+        return self.instances is not None
+
+    def init(self):
+        self.instances = {}
+        self.queries = {}
+
+    def cleanup(self):
+        self.instances = None
+        self.queries = None
+
+    def get(self, cls, pk):
+        if self.instances is None:
+            return None
+        return self.instances.get((cls.__table__, pk))
+
+    def add(self, m):
+        """
+        登记一个从数据库读取的实例，如果已有同一主键的实例则返回已有的实例，
+        并补充已有实例中缺少的字段（不覆盖内存中的修改）
+        :param m:
+        :return:
+        """
+        if m is None or self.instances is None:
+            return m
+        key = (m.__table__, dict.get(m, m.__primary_key__.name))
+        existing = self.instances.get(key)
+        if existing is None:
+            self.instances[key] = m
+            return m
+        for k, v in m.iteritems():
+            if k not in existing:
+                dict.__setitem__(existing, k, v)
+        return existing
+
+    def remove(self, m):
+        if self.instances is not None:
+            self.instances.pop((m.__table__, dict.get(m, m.__primary_key__.name)), None)
+
+    def query_key(self, cls, sql, args, first=False):
+        if self.queries is None:
+            return None
+        # find_first and find_by build the same sql, first tells their results apart:
+        key = (cls.__table__, sql, args, first)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def invalidate(self, table):
+        if self.queries:
+            for key in [k for k in self.queries if k[0] == table]:
+                del self.queries[key]
+
+#thread-local identity map:
+_identity = _IdentityMap()
+
+class _IdentityMapCtx(object):
+    """
+    开启身份映射的上下文对象，可以嵌套使用，最外层退出时清空，比如:
+    with identity_map():
+        pass
+    """
+    def __enter__(self):
+        self.should_cleanup = False
+        if not _identity.is_init():
+            _identity.init()
+            self.should_cleanup = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.should_cleanup:
+            _identity.cleanup()
+
+def identity_map():
+    """
+    开启当前线程的身份映射，通常在一个请求的范围内使用
+    :return:
+    """
+    return _IdentityMapCtx()
+
+def with_identity_map(func):
+    """
+    设计一个装饰器 替换with语法
+    :param func:
+    :return:
+    """
+    @functools.wraps(func)
+    def _wrapper(*args, **kw):
+        with _IdentityMapCtx():
+            return func(*args, **kw)
+    return _wrapper
+
+# process-wide cache used by models which set __cache__ = True:
+_default_cache = LRUCache(max_size=10000, ttl=60)
+
+def set_default_cache(backend):
+    """
+    替换__cache__ = True的Model使用的默认缓存后端
+    :param backend: CacheBackend对象
+    :return:
+    """
+    global _default_cache
+    _default_cache = backend
+
+def get_default_cache():
+    return _default_cache
+
+class _CacheFills(object):
+    """
+    记录正在回源读取的缓存key，清除缓存时使这些读取作废，
+    避免清除之前开始的读取在清除之后把旧数据写回缓存
+    只记录正在读取的key，占用的内存只与并发读取的数量有关
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> [generation, number of reads in progress]
+        self._fills = {}
+
+    def begin(self, key):
+        """
+        开始回源读取，返回key当前的generation
+        :param key:
+        :return:
+        """
+        with self._lock:
+            fill = self._fills.setdefault(key, [0, 0])
+            fill[1] += 1
+            return fill[0]
+
+    def end(self, cache, key, generation, value):
+        """
+        结束回源读取，begin之后key没有被清除时才把value写入缓存
+        :param cache:
+        :param key:
+        :param generation: begin返回的generation
+        :param value: 读取的结果，None表示不写入
+        :return:
+        """
+        with self._lock:
+            fill = self._fills[key]
+            fill[1] -= 1
+            if fill[1] == 0:
+                del self._fills[key]
+            if value is not None and fill[0] == generation:
+                cache.set(key, value)
+
+    def evict(self, cache, key):
+        with self._lock:
+            fill = self._fills.get(key)
+            if fill:
+                fill[0] += 1
+            cache.delete(key)
+
+_cache_fills = _CacheFills()
+
 class Field(object):
     """
     保存数据库中的表的 字段属性
@@ -40,6 +317,7 @@ class Field(object):
         self.updatable = kw.get('updatable', True)
         self.insertable = kw.get('insertable', True)
         self.ddl = kw.get('ddl', '')
+        self.deferred = kw.get('deferred', False)
         self._order = Field._count
         Field._count += 1
 
@@ -175,6 +453,9 @@ class ModelMetaclass(type):
                     if v.nullable:
                         logging.warning('NOTE: change primary key to non-nullable.')
                         v.nullable = False
+                    if v.deferred:
+                        logging.warning('NOTE: change primary key to non-deferred.')
+                        v.deferred = False
                     primary_key = v
                 mappings[k] = v
         #check exist of primary key:
@@ -187,6 +468,7 @@ class ModelMetaclass(type):
         attrs['__mappings__'] = mappings
         attrs['__primary_key__'] = primary_key
         attrs['__sql__'] = lambda self:_gen_sql(attrs['__table__'], mappings)
+        _gen_statements(attrs, mappings, primary_key)
         for trigger in _triggers:
             if not trigger in attrs:
                 attrs[trigger] = None
@@ -201,8 +483,15 @@ class Model(dict):
         "__mappings__": 字段对象（字段的所有属性，见Field类）
         "__primary_key__":主键字段
         "__sql__": 创建表时执行的sql
+        "__insert_sql__", "__update_sql__", "__delete_sql__", "__select_pk_sql__": 预先生成的sql
+        "__deferred__": 按需读取的字段，查询时默认不读取，第一次访问该属性时才从数据库加载
+    子类可以定义"__count_ttl__"设置count_all/count_by的计数缓存秒数，0表示不缓存
+    子类可以定义"__cache__"开启get的进程内读缓存: True表示使用默认缓存后端，
+    或者指定一个CacheBackend对象；update/delete会使缓存失效
     """
     __metaclass__ = ModelMetaclass
+    __count_ttl__ = 10
+    __cache__ = None
     def __init__(self, **kw):
         super(Model, self).__init__(**kw)
 
@@ -216,7 +505,12 @@ class Model(dict):
         try:
             return self[key]
         except KeyError:
-            raise AttributeError(r"'Dict' object has no attribute '%s'" % key)
+            pass
+        if self.__dict__.get('_partial') and key in getattr(type(self), '__mappings__', ()):
+            self._load_missing()
+            if key in self:
+                return self[key]
+        raise AttributeError(r"'Dict' object has no attribute '%s'" % key)
 
     def __setattr__(self, key, value):
         """
@@ -228,56 +522,271 @@ class Model(dict):
         """
         self[key] = value
 
+    def _load_missing(self):
+        """
+        加载查询时没有读取的字段（按需读取的字段或投影查询未选择的字段），
+        一次查询读取所有缺失的字段
+        :return:
+        """
+        missing = [(k, f) for k, f in self.__mappings__.iteritems() if k not in self]
+        del self.__dict__['_partial']
+        if not missing:
+            return
+        pk = self.__primary_key__.name
+        sql = 'select %s from `%s` where `%s`=?' % (','.join(['`%s`' % f.name for k, f in missing]), self.__table__, pk)
+        row = db.select_one_row(sql, dict.__getitem__(self, pk))
+        if row is not None:
+            dict.update(self, itertools.izip([k for k, f in missing], row))
+
+    @classmethod
+    def _select_list(cls, columns):
+        """
+        生成select的字段列表
+        :param columns: None表示除按需读取字段外的所有字段，'*'表示所有字段，
+                        或者字段名的列表，主键总是会被选择
+        :return:
+        """
+        if columns is None:
+            return cls.__select_columns__
+        if columns == '*':
+            return '*'
+        names = []
+        for c in columns:
+            if c not in cls.__mappings__:
+                raise ValueError('No field "%s" in class: %s' % (c, cls.__name__))
+            names.append(cls.__mappings__[c].name)
+        pk = cls.__primary_key__.name
+        if pk not in names:
+            names.insert(0, pk)
+        return ','.join(['`%s`' % name for name in names])
+
     @classmethod
-    def get(cls, pk):
+    def _row_factory(cls, names):
+        """
+        作为db模块的行构造函数，直接由cursor返回的tuple生成实例，
+        不再经过中间的Dict和关键字参数字典
+        缺少部分字段的实例会被标记，访问缺失字段时再从数据库加载
+        :param names:
+        :return:
+        """
+        names = tuple(names)
+        partial = len(cls.__mappings__.viewkeys() & set(names)) < len(cls.__mappings__)
+        def _make(values):
+            m = dict.__new__(cls)
+            dict.update(m, itertools.izip(names, values))
+            if partial:
+                m.__dict__['_partial'] = True
+            return m
+        return _make
+
+    @classmethod
+    def get(cls, pk, columns=None):
         """
         Get by primary key.
         :param pk:
+        :param columns: 需要读取的字段，见_select_list
+        :return:
+        """
+        if columns is None:
+            m = _identity.get(cls, pk)
+            if m is not None:
+                return m
+        cache = cls._cache_backend()
+        if cache is not None and columns in (None, '*'):
+            return _identity.add(cls._get_cached(cache, pk, columns))
+        sql = cls.__select_pk_sql__ if columns is None else 'select %s from `%s` where `%s`=?' % (cls._select_list(columns), cls.__table__, cls.__primary_key__.name)
+        return _identity.add(db.select_one_row(sql, pk, factory=cls._row_factory))
+
+    @classmethod
+    def _cache_backend(cls):
+        c = cls.__cache__
+        return _default_cache if c is True else c
+
+    @classmethod
+    def _cache_key(cls, pk):
+        return '%s:%s' % (cls.__table__, pk)
+
+    @classmethod
+    def _get_cached(cls, cache, pk, columns):
+        """
+        读缓存，未命中时从数据库读取并写入缓存
+        缓存中保存的是字段值的字典，每次返回新的实例，调用方修改实例不会影响缓存
+        :param cache:
+        :param pk:
+        :param columns: None或者'*'，'*'要求缓存中包含所有字段
+        :return:
+        """
+        key = cls._cache_key(pk)
+        d = cache.get(key)
+        if d is not None and (columns is None or len(d) >= len(cls.__mappings__)):
+            return cls._row_factory(d.keys())(d.values())
+        sql = cls.__select_pk_sql__ if columns is None else 'select * from `%s` where `%s`=?' % (cls.__table__, cls.__primary_key__.name)
+        generation = _cache_fills.begin(key)
+        m = None
+        try:
+            # fill the process-wide cache from primary, a lagging replica may return data before a write:
+            with db.read_primary():
+                m = db.select_one_row(sql, pk, factory=cls._row_factory)
+        finally:
+            # not cached if evicted while reading, the row may be read before the write:
+            _cache_fills.end(cache, key, generation, None if m is None else dict(m))
+        return m
+
+    @classmethod
+    def _evict_cached(cls, pk):
+        """
+        清除pk的缓存，在事务中时提交后再清除一次，提交之前其他线程仍会读到旧数据并写回缓存
+        :param pk:
+        :return:
+        """
+        cache = cls._cache_backend()
+        if cache is not None:
+            key = cls._cache_key(pk)
+            _cache_fills.evict(cache, key)
+            if db.in_transaction():
+                db.after_commit(_cache_fills.evict, cache, key)
+
+    @classmethod
+    def _find(cls, sql, args, first=False):
+        """
+        执行查询，开启身份映射时相同的查询直接返回已经加载的实例
+        :param sql:
+        :param args:
+        :param first: 为True时只返回第一个结果
         :return:
         """
-        d = db.select_one('select * from %s where %s=?' % (cls.__table__, cls.__primary_key__.name), pk)
-        return cls(**d) if d else None
+        key = _identity.query_key(cls, sql, args, first)
+        if key is not None and key in _identity.queries:
+            r = _identity.queries[key]
+            return r if first else list(r)
+        if first:
+            r = _identity.add(db.select_one_row(sql, *args, factory=cls._row_factory))
+        else:
+            r = [_identity.add(m) for m in db.select_rows(sql, *args, factory=cls._row_factory)]
+        if key is not None:
+            _identity.queries[key] = r if first else list(r)
+        return r
 
     @classmethod
-    def find_first(cls, where, *args):
+    def find_first(cls, where, *args, **kw):
         """
         通过where语句进行条件查询，返回一个查询结果。如果有多个查询结果仅取第一个
         如果没有结果，则返回None
         :param where:
         :param args:
+        :param columns: 需要读取的字段，见_select_list
         :return:
         """
-        d = db.select_one('select * from %s %s' % (cls.__table__, where), *args)
-        return cls(**d) if d else None
+        sql = 'select %s from `%s` %s' % (cls._select_list(kw.get('columns')), cls.__table__, where)
+        return cls._find(sql, args, True)
 
     @classmethod
-    def find_all(cls, *args):
+    def find_all(cls, *args, **kw):
         """
-        查询所有字段，将结果以一个列表返回
+        查询所有记录，将结果以一个列表返回
         :param args:
+        :param columns: 需要读取的字段，见_select_list
         :return:
         """
-        L = db.select('select * from `%s`' % cls.__table__)
-        return [cls(**d) for d in L]
+        sql = 'select %s from `%s`' % (cls._select_list(kw.get('columns')), cls.__table__)
+        return cls._find(sql, ())
 
     @classmethod
-    def find_by(cls, where, *args):
+    def find_by(cls, where, *args, **kw):
         """
         通过where语句进行条件查询，将结果以一个列表返回
         :param where:
         :param args:
+        :param columns: 需要读取的字段，见_select_list
         :return:
         """
-        L = db.select('select * from `%s` %s' % (cls.__table__, where), *args)
-        return [cls(**d) for d in L]
+        sql = 'select %s from `%s` %s' % (cls._select_list(kw.get('columns')), cls.__table__, where)
+        return cls._find(sql, args)
+
+    @classmethod
+    def find_iter(cls, where='', *args, **kw):
+        """
+        通过where语句进行条件查询，以生成器的形式逐个返回结果，适合导出等大结果集的场景
+        :param where:
+        :param args:
+        :param columns: 需要读取的字段，见_select_list
+        :param chunk: 每次从数据库读取的行数
+        :return:
+        """
+        sql = 'select %s from `%s` %s' % (cls._select_list(kw.pop('columns', None)), cls.__table__, where)
+        kw['factory'] = cls._row_factory
+        return db.iter_select(sql, *args, **kw)
+
+    @classmethod
+    def find_page(cls, where='', *args, **kw):
+        """
+        键集（游标）分页: 按 (order_by, 主键) 倒序，返回位于after之后的size条记录，
+        查询直接定位到索引上的位置，翻到多深的页都和第一页的代价相同
+        :param where: 不带where关键字的查询条件，比如 'blog_id=?'
+        :param args:
+        :param after: 上一页返回的游标字符串，或者 (order_by的值, 主键值)，None表示第一页
+        :param size: 每页记录数，默认15
+        :param order_by: 排序字段，默认created_at
+        :param columns: 需要读取的字段，见_select_list
+        :return: (记录列表, 下一页的游标字符串)，没有下一页时游标为None
+        """
+        after = kw.get('after')
+        size = kw.get('size', 15)
+        order_by = kw.get('order_by', 'created_at')
+        if order_by not in cls.__mappings__:
+            raise ValueError('No field "%s" in class: %s' % (order_by, cls.__name__))
+        if isinstance(after, basestring):
+            after = decode_cursor(after)
+        order_col = cls.__mappings__[order_by].name
+        pk = cls.__primary_key__.name
+        conditions = []
+        params = []
+        if where:
+            if where.lstrip().lower().startswith('where '):
+                where = where.lstrip()[6:]
+            conditions.append('(%s)' % where)
+            params.extend(args)
+        if after is not None:
+            conditions.append('(`%s`<? or (`%s`=? and `%s`<?))' % (order_col, order_col, pk))
+            params.extend([after[0], after[0], after[1]])
+        params.append(size + 1)
+        sql = 'select %s from `%s` %s order by `%s` desc, `%s` desc limit ?' % (cls._select_list(kw.get('columns')), cls.__table__, 'where %s' % ' and '.join(conditions) if conditions else '', order_col, pk)
+        L = cls._find(sql, tuple(params))
+        if len(L) <= size:
+            return L, None
+        L = L[:size]
+        last = L[-1]
+        return L, encode_cursor((dict.__getitem__(last, order_by), dict.__getitem__(last, cls.__primary_key__.name)))
 
     @classmethod
-    def count_all(cls):
+    def _cached_count(cls, key, sql, *args):
+        """
+        在__count_ttl__秒内复用计数，本进程通过ORM的insert/delete会同步更新计数
+        :param key:
+        :param sql:
+        :param args:
+        :return:
+        """
+        ttl = cls.__count_ttl__
+        if ttl:
+            n = _counts.get(cls.__table__, key)
+            if n is not None:
+                return n
+        n = int(db.select_int(sql, *args) or 0)
+        if ttl:
+            _counts.set(cls.__table__, key, n, ttl)
+        return n
+
+    @classmethod
+    def count_all(cls, approximate=False):
         """
         执行select count(pk) from table语句，返回一个数值
+        :param approximate: 为True时读取InnoDB统计信息中的估算行数，不扫描索引
         :return:
         """
-        return db.select('select count(`%s`) from `%s`' % (cls.__primary_key__.name, cls.__table__))
+        if approximate:
+            return cls._cached_count(_COUNT_APPROXIMATE, 'select table_rows from information_schema.tables where table_schema=database() and table_name=?', cls.__table__)
+        return cls._cached_count(_COUNT_ALL, 'select count(`%s`) from `%s`' % (cls.__primary_key__.name, cls.__table__))
 
     @classmethod
     def count_by(cls, where, *args):
@@ -287,7 +796,13 @@ class Model(dict):
         :param args:
         :return:
         """
-        return db.select_int('select count(`%s`) from `%s` %s' % (cls.__primary_key__.name, cls.__table__, where), *args)
+        sql = 'select count(`%s`) from `%s` %s' % (cls.__primary_key__.name, cls.__table__, where)
+        try:
+            key = (where, args)
+            hash(key)
+        except TypeError:
+            return int(db.select_int(sql, *args))
+        return cls._cached_count(key, sql, *args)
 
     def update(self):
         """
@@ -300,20 +815,19 @@ class Model(dict):
         :return:
         """
         self.pre_update and self.pre_update()
-        L = []
         args = []
-        for k, v in self.__mappings__.iteritems():
-            if v.updatable:
-                if hasattr(self, k):
-                    arg = getattr(self, k)
-                else:
-                    arg = v.default
-                    setattr(self, k, arg)
-                L.append('`%s`=?' % k)
-                args.append(arg)
-        pk = self.__primary_key__.name
-        args.append(getattr(self, pk))
-        db.update('update `%s` set %s where %s=?' % (self.__table__, ','.join(L), pk), *args)
+        for k, v in self.__updatable__:
+            if hasattr(self, k):
+                arg = getattr(self, k)
+            else:
+                arg = v.default
+                setattr(self, k, arg)
+            args.append(arg)
+        args.append(getattr(self, self.__primary_key__.name))
+        db.update(self.__update_sql__, *args)
+        self._evict_cached(args[-1])
+        _identity.invalidate(self.__table__)
+        self.post_update and self.post_update()
         return self
 
     def delete(self):
@@ -322,26 +836,61 @@ class Model(dict):
         :return:
         """
         self.pre_delete and self.pre_delete()
-        pk = self.__primary_key__.name
-        args = (getattr(self, pk), )
-        db.update('delete from `%s` where `%s`=?' % (self.__table__, pk), *args)
+        args = (getattr(self, self.__primary_key__.name), )
+        n = db.update(self.__delete_sql__, *args)
+        self._evict_cached(args[0])
+        _count_changed(self.__table__, -n)
+        _identity.remove(self)
+        _identity.invalidate(self.__table__)
+        self.post_delete and self.post_delete()
         return self
 
     def insert(self):
         """
-        通过db对象的insert接口执行SQL
+        通过db对象的update接口执行预先生成的insert语句
         :return:
         """
         self.pre_insert and self.pre_insert()
-        params = {}
-        for k, v in self.__mappings__.iteritems():
-            if v.insertable:
-                if not hasattr(self, k):
-                    setattr(self, k, v.default)
-                params[v.name] = getattr(self, k)
-        db.insert('%s' % self.__table__, **params)
+        args = []
+        for k, v in self.__insertable__:
+            if not hasattr(self, k):
+                setattr(self, k, v.default)
+            args.append(getattr(self, k))
+        db.update(self.__insert_sql__, *args)
+        _count_changed(self.__table__, 1)
+        _identity.add(self)
+        _identity.invalidate(self.__table__)
+        self.post_insert and self.post_insert()
         return self
 
+    @classmethod
+    def insert_all(cls, instances, batch_size=None):
+        """
+        批量插入: 先对所有实例执行pre_insert并填充默认值，再通过db对象的insert_many接口
+        按批执行多行insert语句
+        :param instances:
+        :param batch_size: 每批的行数，默认使用db.INSERT_BATCH_SIZE
+        :return:
+        """
+        instances = list(instances)
+        rows = []
+        for m in instances:
+            m.pre_insert and m.pre_insert()
+            row = {}
+            for k, v in cls.__insertable__:
+                if not hasattr(m, k):
+                    setattr(m, k, v.default)
+                row[v.name] = getattr(m, k)
+            rows.append(row)
+        n = db.insert_many(cls.__table__, rows, batch_size)
+        _count_changed(cls.__table__, n)
+        for m in instances:
+            _identity.add(m)
+        _identity.invalidate(cls.__table__)
+        for m in instances:
+            m.post_insert and m.post_insert()
+        return instances
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     db.create_engine('www-data', 'www-data', 'test')
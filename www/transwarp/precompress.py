@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+"""
+静态文件预压缩
+    在部署时为静态目录下的文本类文件生成.gz（以及安装了brotli时的.br）兄弟文件，
+    StaticFileRoute根据请求的Accept-Encoding直接返回压缩好的文件，
+    不必在每个请求里花CPU压缩。
+
+    用法：python transwarp/precompress.py [-l LEVEL] [--min-size N] [-f] static
+"""
+import os, sys, gzip, logging, optparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PRECOMPRESS_EXTS = ('.html', '.htm', '.css', '.js', '.json', '.xml', '.svg', '.txt', '.map', '.ico', '.eot', '.ttf')
+
+def _write_atomic(path, data, mtime):
+    '''
+    Write data to path through a temp file, and set mtime same as the original.
+    :param path:
+    :param data:
+    :param mtime:
+    :return:
+    '''
+    tmp = '%s.%s.tmp' % (path, os.getpid())
+    f = open(tmp, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    os.utime(tmp, (mtime, mtime))
+    os.rename(tmp, path)
+
+def _gzip_file(src, dest, level, mtime):
+    tmp = '%s.%s.tmp' % (dest, os.getpid())
+    fin = open(src, 'rb')
+    try:
+        fout = gzip.GzipFile(tmp, 'wb', level, mtime=int(mtime))
+        try:
+            data = fin.read(65536)
+            while data:
+                fout.write(data)
+                data = fin.read(65536)
+        finally:
+            fout.close()
+    finally:
+        fin.close()
+    os.utime(tmp, (mtime, mtime))
+    os.rename(tmp, dest)
+
+def _is_fresh(src_st, dest):
+    try:
+        return int(os.stat(dest).st_mtime) >= int(src_st.st_mtime)
+    except OSError:
+        return False
+
+def precompress_file(path, level=9, min_size=256, force=False):
+    '''
+    Write path.gz and path.br (if brotli installed) next to path unless they are up to date.
+    Return list of written files.
+    :param path:
+    :param level: gzip level, brotli always uses the max quality
+    :param min_size: skip files smaller than this
+    :param force: rewrite even if up to date
+    :return:
+    '''
+    st = os.stat(path)
+    if st.st_size < min_size:
+        return []
+    written = []
+    if force or not _is_fresh(st, path + '.gz'):
+        _gzip_file(path, path + '.gz', level, st.st_mtime)
+        written.append(path + '.gz')
+    if brotli and (force or not _is_fresh(st, path + '.br')):
+        f = open(path, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        _write_atomic(path + '.br', brotli.compress(data, quality=11), st.st_mtime)
+        written.append(path + '.br')
+    return written
+
+def precompress_dir(directory, exts=PRECOMPRESS_EXTS, level=9, min_size=256, force=False):
+    '''
+    Precompress all files with extension in exts under directory.
+    Return list of written files.
+    :param directory:
+    :param exts:
+    :param level:
+    :param min_size:
+    :param force:
+    :return:
+    '''
+    written = []
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in exts:
+                written.extend(precompress_file(os.path.join(root, name), level, min_size, force))
+    return written
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] DIR...')
+    parser.add_option('-l', '--level', type='int', default=9, help='gzip level (default 9)')
+    parser.add_option('--min-size', type='int', default=256, help='skip files smaller than this (default 256)')
+    parser.add_option('-f', '--force', action='store_true', default=False, help='rewrite up to date files')
+    opts, dirs = parser.parse_args(argv)
+    if not dirs:
+        parser.error('no directory given')
+    for d in dirs:
+        written = precompress_dir(d, level=opts.level, min_size=opts.min_size, force=opts.force)
+        logging.info('%s: %d file(s) written' % (d, len(written)))
+    return 0
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
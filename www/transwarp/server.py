@@ -0,0 +1,855 @@
+#!/usr/bin/env python
+#coding=utf-8
+
+"""
+生产环境的WSGI服务器，取代wsgiref.simple_server
+    1. HTTP/1.1: 支持keep-alive，长度未知的响应使用chunked编码，支持chunked请求体和100-continue
+    2. 线程池模式(workers=0): 处理请求的是固定数量的工作线程，待处理的任务放在有界队列里，
+       队列满时直接返回503，不会无限堆积
+       事件循环(event_loop=True，默认): 用poll监听端口和所有空闲的keep-alive连接，
+       连接上有请求到达时才交给线程池，响应发送完再交还给事件循环，
+       因此成千上万个空闲连接只占文件描述符，不占线程；
+       event_loop=False时退回每个连接占用一个线程直到连接关闭
+    3. pre-fork模式(workers>0): 主进程监听端口后fork出N个worker进程，共享同一个监听socket，
+       每个worker内部仍是线程池，从而利用多核
+       信号：SIGTERM/SIGINT 平滑退出，处理完正在进行的请求；
+             SIGHUP 平滑重启，先启动新worker再让旧worker退出；
+             app以'module:attr'字符串给出时，由worker在fork之后导入，因此SIGHUP也会加载新代码
+    4. post_fork(worker_id)钩子在worker进程中、加载app之前调用，可用于初始化每个进程自己的资源，
+       db连接池会自动丢弃从主进程继承的连接
+"""
+import os, sys, time, errno, fcntl, socket, signal, select, logging, threading, functools, traceback, urllib, optparse, email.utils
+import Queue
+
+_SERVER_SOFTWARE = 'transwarp/1.0'
+_MAX_LINE = 65536
+_MAX_HEADERS = 100
+_BLOCK_SIZE = 65536
+
+class _BadRequest(Exception):
+    pass
+
+class FileWrapper(object):
+    '''
+    wsgi.file_wrapper that iterates a file by blocks and closes it at last.
+    '''
+    def __init__(self, filelike, block_size=_BLOCK_SIZE):
+        self.filelike = filelike
+        self.block_size = block_size
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        data = self.filelike.read(self.block_size)
+        if data:
+            return data
+        raise StopIteration
+
+    def close(self):
+        if hasattr(self.filelike, 'close'):
+            self.filelike.close()
+
+class _Input(object):
+    '''
+    wsgi.input reading at most length bytes of request body, and sending
+    '100 Continue' before the first read if the client expects it.
+    '''
+    def __init__(self, rfile, length, send_continue=None):
+        self._rfile = rfile
+        self.remaining = length
+        self._send_continue = send_continue
+
+    def _check_continue(self):
+        if self._send_continue:
+            self._send_continue()
+            self._send_continue = None
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return ''
+        self._check_continue()
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self._rfile.read(size)
+        self.remaining -= len(data)
+        if len(data) < size:
+            self.remaining = 0
+        return data
+
+    def readline(self, size=-1):
+        if self.remaining <= 0:
+            return ''
+        self._check_continue()
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self._rfile.readline(size)
+        self.remaining -= len(data)
+        if not data:
+            self.remaining = 0
+        return data
+
+    def readlines(self, hint=-1):
+        lines = []
+        total = 0
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            lines.append(line)
+            total += len(line)
+            if 0 < hint <= total:
+                break
+        return lines
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def drain(self, limit=_BLOCK_SIZE * 16):
+        '''
+        Skip unread body so the next request on the connection can be parsed.
+        Return False if the body is too large to skip, then the connection must be closed.
+        '''
+        if self.remaining > limit:
+            return False
+        if self._send_continue:
+            # the client is waiting for 100 Continue, it will not send the body.
+            return False
+        while self.remaining > 0:
+            if not self.read(min(self.remaining, _BLOCK_SIZE)):
+                return False
+        return True
+
+def _read_chunked(rfile, max_size):
+    '''
+    Read a chunked request body, return it as str.
+    '''
+    L = []
+    size = 0
+    while True:
+        line = rfile.readline(_MAX_LINE)
+        if not line:
+            raise _BadRequest('incomplete chunked body')
+        try:
+            n = int(line.split(';', 1)[0].strip(), 16)
+        except ValueError:
+            raise _BadRequest('bad chunk size')
+        if n==0:
+            break
+        size += n
+        if size > max_size:
+            raise _BadRequest('request body too large')
+        L.append(rfile.read(n))
+        rfile.readline(_MAX_LINE)
+    # trailers:
+    while True:
+        line = rfile.readline(_MAX_LINE)
+        if not line or line in ('\r\n', '\n'):
+            break
+    return ''.join(L)
+
+class _HttpConnection(object):
+    '''
+    Serve requests of a client connection until it is closed, timed out or the server stops.
+    '''
+    def __init__(self, server, sock, addr):
+        self.server = server
+        self.sock = sock
+        self.addr = addr
+        self.rfile = sock.makefile('rb', -1)
+        self.closed = False
+        server.connection_opened()
+
+    def serve(self, loop=None):
+        '''
+        Serve requests on the connection. With an event loop, give the connection back to the
+        loop when it becomes idle instead of blocking the thread until the next request.
+        '''
+        try:
+            while not self.server.stopping and self.handle_one():
+                if loop is not None and not self._buffered():
+                    loop.resume(self)
+                    return
+        except socket.timeout:
+            pass
+        except socket.error, e:
+            if e.args[0] not in (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED):
+                logging.exception('socket error:')
+        self.close()
+
+    def _buffered(self):
+        '''
+        Return True if pipelined data is already read into the buffer of rfile, the socket would not
+        become readable for it. Assume True if the buffer is unknown, then the thread keeps serving.
+        '''
+        rbuf = getattr(self.rfile, '_rbuf', None)
+        return rbuf is None or rbuf.tell() > 0
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.server.connection_closed()
+        try:
+            self.rfile.close()
+            self.sock.close()
+        except socket.error:
+            pass
+
+    def _send_error(self, status):
+        body = '<html><body><h1>%s</h1></body></html>' % status
+        self.sock.sendall('HTTP/1.1 %s\r\nContent-Type: text/html\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s' % (status, len(body), body))
+
+    def _parse_request(self):
+        '''
+        Parse request line and headers, return environ or None if the client closed.
+        '''
+        self.sock.settimeout(self.server.keepalive_timeout)
+        line = self.rfile.readline(_MAX_LINE)
+        while line in ('\r\n', '\n'):
+            line = self.rfile.readline(_MAX_LINE)
+        if not line:
+            return None
+        self.sock.settimeout(self.server.timeout)
+        if len(line) >= _MAX_LINE:
+            raise _BadRequest('request line too long')
+        parts = line.split()
+        if len(parts)!=3 or not parts[2].startswith('HTTP/'):
+            raise _BadRequest('bad request line')
+        method, target, version = parts
+        path, _, query = target.partition('?')
+        if '://' in path:
+            # absolute form: http://host/path
+            path = '/' + path.split('://', 1)[1].partition('/')[2]
+        env = {
+            'REQUEST_METHOD': method.upper(),
+            'SCRIPT_NAME': '',
+            'PATH_INFO': urllib.unquote(path),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.server.server_name,
+            'SERVER_PORT': str(self.server.port),
+            'SERVER_PROTOCOL': version,
+            'SERVER_SOFTWARE': _SERVER_SOFTWARE,
+            'REMOTE_ADDR': self.addr[0] if self.addr else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': self.server.workers > 0,
+            'wsgi.run_once': False,
+            'wsgi.file_wrapper': FileWrapper,
+        }
+        for i in range(_MAX_HEADERS + 1):
+            line = self.rfile.readline(_MAX_LINE)
+            if not line:
+                raise _BadRequest('incomplete headers')
+            if line in ('\r\n', '\n'):
+                break
+            if i==_MAX_HEADERS:
+                raise _BadRequest('too many headers')
+            name, sep, value = line.partition(':')
+            if not sep:
+                raise _BadRequest('bad header line')
+            name = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if name=='CONTENT_TYPE' or name=='CONTENT_LENGTH':
+                env[name] = value
+            else:
+                key = 'HTTP_' + name
+                env[key] = '%s,%s' % (env[key], value) if key in env else value
+        return env
+
+    def handle_one(self):
+        '''
+        Handle one request, return True if the connection can be kept alive.
+        '''
+        try:
+            env = self._parse_request()
+            if env is None:
+                return False
+            version = env['SERVER_PROTOCOL']
+            connection = env.get('HTTP_CONNECTION', '').lower()
+            if version=='HTTP/1.1':
+                keep_alive = 'close' not in connection
+            else:
+                keep_alive = 'keep-alive' in connection
+            send_continue = None
+            if env.get('HTTP_EXPECT', '').lower()=='100-continue' and version=='HTTP/1.1':
+                send_continue = lambda: self.sock.sendall('HTTP/1.1 100 Continue\r\n\r\n')
+            if 'chunked' in env.get('HTTP_TRANSFER_ENCODING', '').lower():
+                if send_continue:
+                    send_continue()
+                body = _read_chunked(self.rfile, self.server.max_body)
+                env['CONTENT_LENGTH'] = str(len(body))
+                from cStringIO import StringIO
+                env['wsgi.input'] = StringIO(body)
+                wsgi_input = None
+            else:
+                try:
+                    length = int(env.get('CONTENT_LENGTH') or 0)
+                except ValueError:
+                    raise _BadRequest('bad content length')
+                if length < 0 or length > self.server.max_body:
+                    raise _BadRequest('bad content length')
+                wsgi_input = env['wsgi.input'] = _Input(self.rfile, length, send_continue)
+        except _BadRequest, e:
+            logging.warning('bad request from %s: %s' % (self.addr, e))
+            self._send_error('400 Bad Request')
+            return False
+        keep_alive = self.run_app(env, keep_alive)
+        if keep_alive and wsgi_input is not None:
+            keep_alive = wsgi_input.drain()
+        return keep_alive
+
+    def run_app(self, env, keep_alive):
+        state = dict(status=None, headers=None, sent=False, chunked=False)
+        is_head = env['REQUEST_METHOD']=='HEAD'
+        http11 = env['SERVER_PROTOCOL']=='HTTP/1.1'
+
+        def send_headers(body_length):
+            headers = state['headers']
+            names = set(k.lower() for k, v in headers)
+            code = state['status'][:3]
+            no_content = code in ('204', '304') or code.startswith('1')
+            no_body = is_head or no_content
+            if 'content-length' not in names and not no_content:
+                if is_head:
+                    if body_length:
+                        # the app returned the body of GET, which is dropped
+                        headers.append(('Content-Length', str(body_length)))
+                    else:
+                        # length unknown: close rather than leave the client guessing the framing
+                        state['keep_alive'] = False
+                elif body_length is not None:
+                    headers.append(('Content-Length', str(body_length)))
+                elif http11:
+                    headers.append(('Transfer-Encoding', 'chunked'))
+                    state['chunked'] = True
+                else:
+                    state['keep_alive'] = False
+            if 'date' not in names:
+                headers.append(('Date', email.utils.formatdate(usegmt=True)))
+            if 'server' not in names:
+                headers.append(('Server', _SERVER_SOFTWARE))
+            headers.append(('Connection', 'keep-alive' if state['keep_alive'] else 'close'))
+            L = ['HTTP/1.1 %s\r\n' % state['status']]
+            L.extend(['%s: %s\r\n' % (k, v) for k, v in headers])
+            L.append('\r\n')
+            self.sock.sendall(''.join(L))
+            state['sent'] = True
+            state['no_body'] = no_body
+
+        def write(data):
+            if not state['sent']:
+                send_headers(None)
+            if not data or state['no_body']:
+                return
+            if state['chunked']:
+                self.sock.sendall('%x\r\n%s\r\n' % (len(data), data))
+            else:
+                self.sock.sendall(data)
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info:
+                try:
+                    if state['sent']:
+                        raise exc_info[0], exc_info[1], exc_info[2]
+                finally:
+                    exc_info = None
+            elif state['status'] is not None:
+                raise AssertionError('start_response called twice')
+            state['status'] = status
+            state['headers'] = list(headers)
+            return write
+
+        state['keep_alive'] = keep_alive and not self.server.stopping
+        result = None
+        try:
+            result = self.server.app(env, start_response)
+            if isinstance(result, str):
+                # a str is one body, not an iterable of one-byte chunks
+                result = [result]
+            if isinstance(result, (list, tuple)) and not state['sent']:
+                body = ''.join(result)
+                send_headers(len(body))
+                write(body)
+            else:
+                for data in result:
+                    write(data)
+                if not state['sent']:
+                    send_headers(0)
+            if state['chunked']:
+                self.sock.sendall('0\r\n\r\n')
+        except socket.error:
+            raise
+        except Exception:
+            logging.exception('error in wsgi application:')
+            if state['sent']:
+                return False
+            body = '<html><body><h1>500 Internal Server Error</h1></body></html>'
+            self.sock.sendall('HTTP/1.1 500 Internal Server Error\r\nContent-Type: text/html\r\nContent-Length: %d\r\nConnection: close\r\n\r\n%s' % (len(body), body))
+            return False
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return state['keep_alive']
+
+class _ThreadPool(object):
+    '''
+    Fixed number of threads running functions from a bounded queue.
+    '''
+    def __init__(self, threads, max_queue):
+        self.queue = Queue.Queue(max_queue)
+        self.threads = []
+        for i in range(threads):
+            t = threading.Thread(target=self._work, name='transwarp-worker-%d' % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def _work(self):
+        while True:
+            fn = self.queue.get()
+            if fn is None:
+                return
+            try:
+                fn()
+            except Exception:
+                logging.exception('error in worker thread:')
+
+    def submit(self, fn):
+        '''
+        Queue fn to run in a pool thread, raise Queue.Full if all threads are busy and the queue is full.
+        '''
+        self.queue.put_nowait(fn)
+
+    def stop(self, timeout=None):
+        '''
+        Let threads finish queued functions and exit.
+        '''
+        for t in self.threads:
+            self.queue.put(None)
+        deadline = None if timeout is None else time.time() + timeout
+        for t in self.threads:
+            t.join(None if deadline is None else max(0.0, deadline - time.time()))
+
+def _reject(sock, addr):
+    logging.warning('server busy, reject connection from %s' % (addr, ))
+    try:
+        sock.sendall('HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+    except socket.error:
+        pass
+    sock.close()
+
+class _EventLoop(object):
+    '''
+    Wait on the listening socket and idle keep-alive connections with poll (select if poll is
+    not available), and hand a connection to the thread pool only when a request arrives on it.
+    A pool thread gives the connection back by resume() after the response is sent.
+    '''
+    def __init__(self, server, pool):
+        self.server = server
+        self.pool = pool
+        self._idle = {}
+        self._fds = set()
+        self._lock = threading.Lock()
+        self._resumed = []
+        self._wake_r, self._wake_w = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._poller = select.poll() if hasattr(select, 'poll') else None
+
+    def _watch(self, fd):
+        self._fds.add(fd)
+        if self._poller is not None:
+            self._poller.register(fd, select.POLLIN | select.POLLPRI)
+
+    def _unwatch(self, fd):
+        self._fds.discard(fd)
+        if self._poller is not None:
+            self._poller.unregister(fd)
+
+    def _wait(self, timeout):
+        try:
+            if self._poller is not None:
+                return [fd for fd, event in self._poller.poll(timeout * 1000)]
+            return select.select(list(self._fds), [], [], timeout)[0]
+        except select.error, e:
+            if e.args[0]==errno.EINTR:
+                return []
+            raise
+
+    def resume(self, conn):
+        '''
+        Give back an idle keep-alive connection, called from pool threads.
+        '''
+        with self._lock:
+            self._resumed.append(conn)
+        try:
+            os.write(self._wake_w, 'x')
+        except OSError:
+            # pipe is full, the loop is going to wake up anyway
+            pass
+
+    def _park(self, conn):
+        fd = conn.sock.fileno()
+        conn.last_active = time.time()
+        self._idle[fd] = conn
+        self._watch(fd)
+
+    def _accept(self):
+        while True:
+            try:
+                sock, addr = self.server.socket.accept()
+            except socket.error, e:
+                # no more pending connections, or another worker took it
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNABORTED):
+                    return
+                raise
+            sock.setblocking(1)
+            if self.server.open_connections >= self.server.max_connections:
+                _reject(sock, addr)
+                continue
+            self._park(_HttpConnection(self.server, sock, addr))
+
+    def _dispatch(self, fd):
+        conn = self._idle.pop(fd)
+        self._unwatch(fd)
+        try:
+            self.pool.submit(functools.partial(conn.serve, self))
+        except Queue.Full:
+            _reject(conn.sock, conn.addr)
+            conn.close()
+
+    def _wakeup(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except OSError:
+            pass
+        with self._lock:
+            resumed = self._resumed
+            self._resumed = []
+        for conn in resumed:
+            if self.server.stopping:
+                conn.close()
+            else:
+                self._park(conn)
+
+    def _sweep(self):
+        '''
+        Close connections idle longer than keepalive_timeout.
+        '''
+        expires = time.time() - self.server.keepalive_timeout
+        for fd, conn in self._idle.items():
+            if conn.last_active < expires:
+                del self._idle[fd]
+                self._unwatch(fd)
+                conn.close()
+
+    def run(self):
+        listen_fd = self.server.socket.fileno()
+        self._watch(listen_fd)
+        self._watch(self._wake_r)
+        ppid = os.getppid()
+        last_sweep = time.time()
+        try:
+            while not self.server.stopping:
+                if self.server.workers > 0 and os.getppid()!=ppid:
+                    logging.warning('master process gone, worker %s exits.' % os.getpid())
+                    break
+                for fd in self._wait(1.0):
+                    if fd==listen_fd:
+                        self._accept()
+                    elif fd==self._wake_r:
+                        self._wakeup()
+                    elif fd in self._idle:
+                        self._dispatch(fd)
+                if time.time() - last_sweep >= 1.0:
+                    self._sweep()
+                    last_sweep = time.time()
+        finally:
+            self.server.stopping = True
+            for conn in self._idle.values():
+                conn.close()
+            self._idle.clear()
+
+    def close(self):
+        '''
+        Close connections given back during shutdown and the wakeup pipe.
+        '''
+        self._wakeup()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+def _load_app(app):
+    '''
+    Return wsgi app, import it if given as 'module:attr'.
+    '''
+    if not isinstance(app, basestring):
+        return app
+    module_name, _, attr = app.partition(':')
+    module = __import__(module_name, globals(), locals(), [attr or 'application'])
+    return getattr(module, attr or 'application')
+
+class Server(object):
+    '''
+    HTTP/1.1 WSGI server with a thread pool, optionally in pre-forked worker processes.
+    '''
+    def __init__(self, app, host='127.0.0.1', port=9000, workers=0, threads=16, backlog=128, max_queue=64,
+                 keepalive_timeout=5.0, timeout=30.0, max_body=64*1024*1024, graceful_timeout=30.0, post_fork=None,
+                 event_loop=True, max_connections=1000):
+        '''
+        Init a Server.
+        :param app: wsgi app, or 'module:attr' to import it in each worker process
+        :param host:
+        :param port:
+        :param workers: number of worker processes, 0 to serve in this process
+        :param threads: number of threads per process
+        :param backlog: listen backlog, bounds connections waiting to be accepted
+        :param max_queue: accepted connections waiting for a thread, more get 503
+        :param keepalive_timeout: seconds to wait for the next request on a connection
+        :param timeout: socket timeout while reading a request or sending a response
+        :param max_body: max bytes of request body
+        :param graceful_timeout: seconds to wait in-flight requests on shutdown
+        :param post_fork: function(worker_id) called in each worker process after fork
+        :param event_loop: keep idle connections in an event loop, False for a thread per connection
+        :param max_connections: max open connections per process in event loop mode, more get 503
+        '''
+        self.app = app
+        self.host = host
+        self.port = port
+        self.server_name = host
+        self.workers = workers
+        self.threads = threads
+        self.backlog = backlog
+        self.max_queue = max_queue
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.max_body = max_body
+        self.graceful_timeout = graceful_timeout
+        self.post_fork = post_fork
+        self.event_loop = event_loop
+        self.max_connections = max_connections
+        self.stopping = False
+        self.socket = None
+        self.open_connections = 0
+        self._connections_lock = threading.Lock()
+        self._children = {}
+        self._signals = []
+
+    def bind(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        sock.setblocking(0)
+        self.port = sock.getsockname()[1]
+        self.socket = sock
+        return sock
+
+    def serve_forever(self):
+        '''
+        Serve until SIGTERM or SIGINT.
+        '''
+        if self.socket is None:
+            self.bind()
+        logging.info('transwarp server listening on %s:%s, workers=%s, threads=%s' % (self.host, self.port, self.workers, self.threads))
+        if self.workers > 0:
+            self._run_master()
+        else:
+            self.app = _load_app(self.app)
+            self._install_worker_signals()
+            self._run_worker()
+
+    def stop(self):
+        self.stopping = True
+
+    def connection_opened(self):
+        with self._connections_lock:
+            self.open_connections += 1
+
+    def connection_closed(self):
+        with self._connections_lock:
+            self.open_connections -= 1
+
+    # ---- worker ----
+
+    def _install_worker_signals(self):
+        def _stop(signum, frame):
+            self.stopping = True
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    def _run_worker(self):
+        pool = _ThreadPool(self.threads, self.max_queue)
+        if not self.event_loop:
+            try:
+                self._accept_loop(pool)
+            finally:
+                self.stopping = True
+                self.socket.close()
+                pool.stop(self.graceful_timeout)
+            return
+        loop = _EventLoop(self, pool)
+        try:
+            loop.run()
+        finally:
+            self.stopping = True
+            self.socket.close()
+            pool.stop(self.graceful_timeout)
+            loop.close()
+
+    def _accept_loop(self, pool):
+        '''
+        Thread per connection: a pool thread serves a connection until it is closed.
+        '''
+        ppid = os.getppid()
+        while not self.stopping:
+            if self.workers > 0 and os.getppid()!=ppid:
+                logging.warning('master process gone, worker %s exits.' % os.getpid())
+                break
+            try:
+                readable = select.select([self.socket], [], [], 1.0)[0]
+            except select.error, e:
+                if e.args[0]==errno.EINTR:
+                    continue
+                raise
+            if not readable:
+                continue
+            try:
+                sock, addr = self.socket.accept()
+            except socket.error, e:
+                # another worker took it, or interrupted
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNABORTED):
+                    continue
+                raise
+            sock.setblocking(1)
+            try:
+                pool.submit(_HttpConnection(self, sock, addr).serve)
+            except Queue.Full:
+                _reject(sock, addr)
+
+    # ---- master ----
+
+    def _spawn(self, worker_id):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = worker_id
+            return pid
+        # in worker process:
+        code = 0
+        try:
+            self._children = {}
+            self._install_worker_signals()
+            if self.post_fork:
+                self.post_fork(worker_id)
+            self.app = _load_app(self.app)
+            self._run_worker()
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _run_master(self):
+        def _on_signal(signum, frame):
+            self._signals.append(signum)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, _on_signal)
+        for i in range(self.workers):
+            self._spawn(i)
+        try:
+            while True:
+                while self._signals:
+                    signum = self._signals.pop(0)
+                    if signum in (signal.SIGTERM, signal.SIGINT):
+                        self._shutdown()
+                        return
+                    if signum==signal.SIGHUP:
+                        self._reload()
+                self._reap()
+                time.sleep(0.5)
+        finally:
+            self.socket.close()
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno==errno.ECHILD:
+                    return
+                raise
+            if pid==0:
+                return
+            worker_id = self._children.pop(pid, None)
+            if worker_id is not None and not self.stopping:
+                logging.warning('worker %s (pid %s) exited with status %s, respawn.' % (worker_id, pid, status))
+                self._spawn(worker_id)
+
+    def _kill_all(self, pids, signum):
+        for pid in pids:
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+    def _reload(self):
+        '''
+        Start new workers, then stop old ones gracefully.
+        '''
+        logging.info('reloading %d workers...' % self.workers)
+        old = self._children.keys()
+        for pid in old:
+            self._children.pop(pid)
+        for i in range(self.workers):
+            self._spawn(i)
+        self._kill_all(old, signal.SIGTERM)
+
+    def _shutdown(self):
+        logging.info('shutting down %d workers...' % len(self._children))
+        self.stopping = True
+        pids = self._children.keys()
+        self._children = {}
+        self._kill_all(pids, signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        alive = set(pids)
+        while alive and time.time() < deadline:
+            for pid in list(alive):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0]:
+                        alive.discard(pid)
+                except OSError:
+                    alive.discard(pid)
+            time.sleep(0.1)
+        self._kill_all(alive, signal.SIGKILL)
+
+def serve(app, host='127.0.0.1', port=9000, **kw):
+    '''
+    Serve wsgi app until SIGTERM or SIGINT, see Server for the options.
+    :param app:
+    :param host:
+    :param port:
+    :param kw:
+    :return:
+    '''
+    Server(app, host, port, **kw).serve_forever()
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] MODULE:APP')
+    parser.add_option('-H', '--host', default='127.0.0.1')
+    parser.add_option('-p', '--port', type='int', default=9000)
+    parser.add_option('-w', '--workers', type='int', default=0, help='worker processes, 0 to serve in one process')
+    parser.add_option('-t', '--threads', type='int', default=16, help='threads per process')
+    opts, args = parser.parse_args(argv)
+    if len(args)!=1:
+        parser.error('app is required, e.g. wsgiapp:application')
+    sys.path.insert(0, os.getcwd())
+    serve(args[0], opts.host, opts.port, workers=opts.workers, threads=opts.threads)
+    return 0
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -20,14 +20,21 @@ WSGI概要：
     4. 数据模型： 用于抽取数据（见models模块）
     5. 事物数据：request数据和response数据的封装（thread local）
 """
-import types, os, re, cgi, sys, time, datetime, functools, mimetypes, threading, logging, traceback, urllib
-from db import Dict
+import types, os, re, cgi, sys, time, datetime, functools, mimetypes, threading, logging, traceback, urllib, stat
+import email.utils, gzip, hashlib, uuid
+from db import Dict, read_primary
+from cache import LRUCache
 
 try:
     from cStringIO import StringIO
 except ImportError:
     from StringIO import StringIO
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 ######################################################
 #实现事物数据接口，实现request数据和response数据的存储，
 #是一个全局ThreadLocal对象
@@ -213,7 +220,7 @@ class HttpError(Exception):
         :param code:
         """
         super(HttpError, self).__init__()
-        self.status = '%d %s' % (code, _RE_RESPONSE_STATUS[code])
+        self.status = '%d %s' % (code, _RESPONSE_STATUSES[code])
 
     def header(self, name, value):
         """
@@ -388,6 +395,30 @@ def post(path):
         return func
     return _decorator
 
+def put(path):
+    '''
+    A @put decorator.
+    :param path:
+    :return:
+    '''
+    def _decorator(func):
+        func.__web_route__ = path
+        func.__web_method__ = 'PUT'
+        return func
+    return _decorator
+
+def delete(path):
+    '''
+    A @delete decorator.
+    :param path:
+    :return:
+    '''
+    def _decorator(func):
+        func.__web_route__ = path
+        func.__web_method__ = 'DELETE'
+        return func
+    return _decorator
+
 _re_route = re.compile(r'(\:[a-zA-Z_]\w*)')
 
 def _build_regex(path):
@@ -427,8 +458,12 @@ class Route(object):
     def __init__(self, func):
         self.path = func.__web_route__
         self.method = func.__web_method__
-        self.is_static = _re_route.search(self.path) is None
-        if not self.is_static:
+        catch_all = self.path.endswith('/*')
+        self.is_static = _re_route.search(self.path) is None and not catch_all
+        if catch_all:
+            # same as the router: the rest of the path is the last argument
+            self.route = re.compile(_build_regex(self.path[:-1])[:-1] + '(.*)$')
+        elif not self.is_static:
             self.route = re.compile(_build_regex(self.path))
         self.func = func
 
@@ -448,32 +483,350 @@ class Route(object):
 
     __repr__ = __str__
 
-def _static_file_generator(fpath):
-    BLOCK_SIZE = 8192
-    with open(fpath, 'rb') as f:
-        block = f.read(BLOCK_SIZE)
-        while block:
+class _RouteNode(object):
+    '''
+    A node of the route trie, one level per path segment.
+    '''
+    def __init__(self):
+        self.children = {}      # literal segment -> node
+        self.patterns = []      # [(regex, node)] for segments like 'a-:id.html'
+        self.param = None       # node for a whole segment variable like ':id'
+        self.catch_all = {}     # method -> route matching all remaining segments
+        self.routes = {}        # method -> route ending at this node
+
+class Router(object):
+    '''
+    Route table compiled into a segment trie.
+
+    Static paths are looked up in a dict. Other paths walk the trie one segment
+    at a time, preferring a literal segment over a partial variable segment over
+    a whole variable segment, so the cost depends on the path length and not on
+    the number of routes:
+
+    >>> router = Router()
+    >>> f = lambda *args: args
+    >>> for path in ('/blog/:id', '/blog/new', '/api/:a/comments/:b'):
+    ...     router.add(Route(get(path)(f)))
+    >>> router.add(Route(post('/blog/:id')(f)))
+    >>> router.match('GET', '/blog/new')
+    (Route(static, GET, path=/blog/new), ())
+    >>> router.match('GET', '/blog/123')
+    (Route(dynamic, GET, path=/blog/:id), ('123',))
+    >>> router.match('HEAD', '/api/x/comments/y')
+    (Route(dynamic, GET, path=/api/:a/comments/:b), ('x', 'y'))
+    >>> router.match('PUT', '/blog/123')
+    Traceback (most recent call last):
+      ...
+    HttpError: 405 Method Not Allowed
+    >>> router.match('GET', '/blog/1/2')
+    Traceback (most recent call last):
+      ...
+    HttpError: 404 Not Found
+    >>> router.add(Route(get('/files/*')(f)))
+    >>> router.match('GET', '/files/a/b.txt')
+    (Route(dynamic, GET, path=/files/*), ('a/b.txt',))
+    '''
+    def __init__(self):
+        self._static = {}
+        self._root = _RouteNode()
+
+    def add(self, route):
+        '''
+        Add a route. A path ending with '/*' matches every path under it and the
+        rest of the path is passed as the only argument.
+        :param route:
+        :return:
+        '''
+        if route.is_static:
+            self._static.setdefault(route.path, {})[route.method] = route
+            return
+        node = self._root
+        segments = route.path.split('/')
+        catch_all = segments[-1]=='*'
+        if catch_all:
+            segments = segments[:-1]
+        for seg in segments:
+            node = self._add_segment(node, seg)
+        if catch_all:
+            node.catch_all[route.method] = route
+        else:
+            node.routes[route.method] = route
+
+    def _add_segment(self, node, seg):
+        if _re_route.search(seg) is None:
+            child = node.children.get(seg)
+            if child is None:
+                child = node.children[seg] = _RouteNode()
+            return child
+        if _re_route.match(seg) and _re_route.match(seg).end()==len(seg):
+            if node.param is None:
+                node.param = _RouteNode()
+            return node.param
+        regex = _build_regex(seg)
+        for r, child in node.patterns:
+            if r.pattern==regex:
+                return child
+        child = _RouteNode()
+        node.patterns.append((re.compile(regex), child))
+        return child
+
+    def _walk(self, node, segments, i, args, found):
+        '''
+        Collect (routes, args) of nodes matching segments[i:] into found, stop at
+        the first one accepted by found.
+        '''
+        if node.catch_all and i<len(segments):
+            if found(node.catch_all, args + ['/'.join(segments[i:])]):
+                return True
+        if i==len(segments):
+            return bool(node.routes) and found(node.routes, args)
+        seg = segments[i]
+        child = node.children.get(seg)
+        if child is not None and self._walk(child, segments, i+1, args, found):
+            return True
+        for regex, child in node.patterns:
+            m = regex.match(seg)
+            if m and self._walk(child, segments, i+1, args + list(m.groups()), found):
+                return True
+        if seg and node.param is not None:
+            return self._walk(node.param, segments, i+1, args + [seg], found)
+        return False
+
+    def match(self, method, path):
+        '''
+        Return (route, args) for request method and path, a HEAD request falls back
+        to the GET route. Raise 404 if no route matches the path, or 405 with an
+        Allow header if routes match the path but not the method.
+        :param method:
+        :param path:
+        :return:
+        '''
+        allowed = set()
+        methods = (method, 'GET') if method=='HEAD' else (method, )
+        routes = self._static.get(path)
+        if routes:
+            for m in methods:
+                if m in routes:
+                    return routes[m], ()
+            allowed.update(routes)
+        result = []
+        def _found(routes, args):
+            for m in methods:
+                if m in routes:
+                    result.append((routes[m], tuple(args)))
+                    return True
+            allowed.update(routes)
+            return False
+        if self._walk(self._root, path.split('/'), 0, [], _found):
+            return result[0]
+        if allowed:
+            if 'GET' in allowed:
+                allowed.add('HEAD')
+            if hasattr(ctx, 'response'):
+                ctx.response.set_header('Allow', ', '.join(sorted(allowed)))
+            raise HttpError(405)
+        raise notfound()
+
+def _static_file_generator(f, length, block_size=65536):
+    '''
+    Yield length bytes read from the current position of file f, then close f.
+    '''
+    try:
+        while length > 0:
+            block = f.read(min(block_size, length))
+            if not block:
+                break
+            length = length - len(block)
             yield block
-            block = f.read(BLOCK_SIZE)
+    finally:
+        f.close()
+
+_RE_BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def _parse_range(value, size):
+    '''
+    Parse a single byte range header as (start, end) with end inclusive.
+    Return None if the header should be ignored (malformed or multiple ranges),
+    or False if the range can not be satisfied.
+
+    >>> _parse_range('bytes=0-99', 1000)
+    (0, 99)
+    >>> _parse_range('bytes=900-', 1000)
+    (900, 999)
+    >>> _parse_range('bytes=-100', 1000)
+    (900, 999)
+    >>> _parse_range('bytes=500-2000', 1000)
+    (500, 999)
+    >>> _parse_range('bytes=1000-', 1000)
+    False
+    >>> _parse_range('bytes=0-1,5-9', 1000)
+    '''
+    m = _RE_BYTE_RANGE.match(value.replace(' ', ''))
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    if not m.group(1):
+        length = int(m.group(2))
+        if length==0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(m.group(1))
+    end = int(m.group(2)) if m.group(2) else size - 1
+    if start >= size:
+        return False
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+_RE_ETAG_ENCODING = re.compile(r'-(?:gzip|br)"$')
+
+def _normalize_etag(etag):
+    '''
+    Normalize ETag for weak comparison, which also ignores the content coding
+    suffix added by Compressor.
+
+    >>> _normalize_etag(' W/"abc-gzip"')
+    '"abc"'
+    '''
+    etag = etag.strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    return _RE_ETAG_ENCODING.sub('"', etag)
+
+def _http_date(t):
+    return email.utils.formatdate(t, usegmt=True)
 
 class StaticFileRoute(object):
-    def __init__(self):
+    '''
+    Serve files under a directory of document root, with Content-Length, ETag and
+    Last-Modified, conditional requests answered by 304 and single byte ranges.
+
+    The file is handed to wsgi.file_wrapper if the server provides one, so a
+    server supporting sendfile() sends it without Python reading each block.
+    '''
+    def __init__(self, prefix='/static/', directory='static', max_age=None):
+        '''
+        Init a StaticFileRoute.
+        :param prefix: url prefix to serve
+        :param directory: directory relative to document root
+        :param max_age: seconds for Cache-Control max-age, None to not send it
+        '''
+        self.path = prefix + '*'
         self.method = 'GET'
         self.is_static = False
-        self.route = re.compile('^/static/(.+)$')
+        self.prefix = prefix
+        self.directory = directory
+        self.max_age = max_age
+        self.route = re.compile('^%s(.+)$' % re.escape(prefix))
 
     def match(self, url):
-        if url.startswith('/static/'):
-            return (url[1:], )
+        if url.startswith(self.prefix):
+            return (url[len(self.prefix):], )
         return None
 
     def __call__(self, *args):
-        fpath = os.path.join(ctx.application.document_root, args[0])
-        if not os.path.isfile(fpath):
+        root = os.path.abspath(os.path.join(ctx.application.document_root, self.directory))
+        fpath = os.path.abspath(os.path.join(root, args[0]))
+        if not fpath.startswith(root + os.sep):
             raise notfound()
-        fext = os.path.splitext(fpath)[1]
-        ctx.response.content_type = mimetypes.types_map.get(fext.lower(), 'application/octet-stream')
-        return _static_file_generator(fpath)
+        try:
+            f = open(fpath, 'rb')
+        except IOError:
+            raise notfound()
+        try:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                raise notfound()
+            response = ctx.response
+            encoding = None
+            if not ctx.request.header('Range'):
+                encoding, sibling = self._precompressed(fpath, st)
+                if encoding:
+                    f.close()
+                    f = sibling
+                    st = os.fstat(f.fileno())
+            if encoding:
+                response.set_header('Content-Encoding', encoding)
+                etag = '"%x-%x-%s"' % (int(st.st_mtime), st.st_size, encoding)
+            else:
+                etag = '"%x-%x"' % (int(st.st_mtime), st.st_size)
+            response.set_header('ETag', etag)
+            response.set_header('Last-Modified', _http_date(st.st_mtime))
+            response.set_header('Accept-Ranges', 'bytes')
+            if self.max_age is not None:
+                response.set_header('Cache-Control', 'public, max-age=%d' % self.max_age)
+            if ctx.request.not_modified(etag, st.st_mtime):
+                response.status = 304
+                response.unset_header('Content-Type')
+                f.close()
+                return []
+            fext = os.path.splitext(fpath)[1]
+            response.content_type = mimetypes.types_map.get(fext.lower(), 'application/octet-stream')
+            byte_range = None
+            range_header = ctx.request.header('Range')
+            if range_header and self._if_range(etag, st.st_mtime):
+                byte_range = _parse_range(range_header, st.st_size)
+            if byte_range is False:
+                response.status = 416
+                response.set_header('Content-Range', 'bytes */%d' % st.st_size)
+                response.content_length = 0
+                f.close()
+                return []
+            if byte_range:
+                start, end = byte_range
+                response.status = 206
+                response.set_header('Content-Range', 'bytes %d-%d/%d' % (start, end, st.st_size))
+                response.content_length = end - start + 1
+                f.seek(start)
+                return _static_file_generator(f, end - start + 1)
+            response.content_length = st.st_size
+        except:
+            f.close()
+            raise
+        file_wrapper = ctx.request.environ.get('wsgi.file_wrapper')
+        if file_wrapper:
+            return file_wrapper(f, 65536)
+        return _static_file_generator(f, st.st_size)
+
+    def _precompressed(self, fpath, st):
+        '''
+        Return (encoding, opened file) of a precompressed sibling like a.css.gz
+        accepted by client and not older than the file, or (None, None).
+        '''
+        vary = False
+        accepted = None
+        for encoding, ext in (('br', '.br'), ('gzip', '.gz')):
+            try:
+                sibling_st = os.stat(fpath + ext)
+            except OSError:
+                continue
+            vary = True
+            if int(sibling_st.st_mtime) < int(st.st_mtime):
+                continue
+            if accepted is None:
+                accepted = _accepted_encodings(ctx.request.header('Accept-Encoding', ''))
+            if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+                try:
+                    sibling = open(fpath + ext, 'rb')
+                except IOError:
+                    continue
+                _add_vary(ctx.response, 'Accept-Encoding')
+                return encoding, sibling
+        if vary:
+            _add_vary(ctx.response, 'Accept-Encoding')
+        return None, None
+
+    def _if_range(self, etag, mtime):
+        '''
+        A range is honored only if If-Range is absent or still matches the file.
+        '''
+        value = ctx.request.header('If-Range')
+        if not value:
+            return True
+        if value.startswith('"') or value.startswith('W/'):
+            return value==etag
+        t = email.utils.parsedate_tz(value)
+        return t is not None and int(email.utils.mktime_tz(t))==int(mtime)
+
 '''
 def favicon_handler():
     return static_file_handler('/favicon.ico')
@@ -659,6 +1012,29 @@ class Request(object):
         '''
         return self._get_headers().get(header.upper(), default)
 
+    def not_modified(self, etag=None, last_modified=None):
+        '''
+        Return True if the client cache is fresh by If-None-Match or, only when
+        If-None-Match is absent, by If-Modified-Since.
+        :param etag: current ETag of the resource, quoted
+        :param last_modified: modify time of the resource as timestamp
+        :return:
+        '''
+        if_none_match = self.header('If-None-Match')
+        if if_none_match is not None:
+            if etag is None:
+                return False
+            if if_none_match.strip()=='*':
+                return True
+            tags = [_normalize_etag(t) for t in if_none_match.split(',')]
+            return _normalize_etag(etag) in tags
+        if_modified_since = self.header('If-Modified-Since')
+        if if_modified_since and last_modified is not None:
+            t = email.utils.parsedate_tz(if_modified_since)
+            if t is not None:
+                return int(last_modified) <= email.utils.mktime_tz(t)
+        return False
+
     def _get_cookies(self):
         if not hasattr(self, '_cookies'):
             cookies = {}
@@ -897,6 +1273,138 @@ class Jinja2TemplateEngine(TemplateEngine):
     def __call__(self, path, model):
         return self._env.get_template(path).render(**model).encode('utf-8')
 
+_COMPRESSIBLE_TYPES = (
+    'text/html',
+    'text/plain',
+    'text/css',
+    'text/javascript',
+    'text/xml',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+)
+
+def _accepted_encodings(accept_encoding):
+    '''
+    Parse Accept-Encoding as dict of encoding -> q value.
+
+    >>> sorted(_accepted_encodings('gzip, deflate;q=0.5, br;q=0').items())
+    [('br', 0.0), ('deflate', 0.5), ('gzip', 1.0)]
+    '''
+    encodings = {}
+    for item in accept_encoding.split(','):
+        parts = item.split(';')
+        name = parts[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            k, _, v = param.strip().partition('=')
+            if k.strip()=='q':
+                try:
+                    q = float(v)
+                except ValueError:
+                    q = 0.0
+        encodings[name] = q
+    return encodings
+
+def _gzip(body, level):
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0)
+    try:
+        f.write(body)
+    finally:
+        f.close()
+    return buf.getvalue()
+
+class Compressor(object):
+    '''
+    Compress response bodies by the Accept-Encoding of request.
+
+    Only complete bodies (str or list of str) with status 200 are compressed, and
+    only if the Content-Type is in content_types and the body has at least
+    min_size bytes. Streamed bodies like static files are sent as is, use
+    precompressed siblings (see transwarp.precompress) for them.
+
+    Vary: Accept-Encoding is added to 200 and 304 responses of those types
+    whatever the body size, so a 304 carries the same Vary as its 200.
+    '''
+    def __init__(self, level=6, min_size=1024, content_types=_COMPRESSIBLE_TYPES, use_brotli=True):
+        '''
+        Init a Compressor.
+        :param level: gzip level 1-9, brotli uses quality 1-11 scaled from it
+        :param min_size: bodies smaller than this are not worth compressing
+        :param content_types: mime types to compress, without parameters
+        :param use_brotli: offer br if the brotli module is installed
+        '''
+        self.level = level
+        self.min_size = min_size
+        self.content_types = frozenset(content_types)
+        self.encodings = ('br', 'gzip') if use_brotli and brotli else ('gzip', )
+
+    def negotiate(self, accept_encoding):
+        '''
+        Return the preferred encoding accepted by client, or None.
+        :param accept_encoding:
+        :return:
+        '''
+        if not accept_encoding:
+            return None
+        accepted = _accepted_encodings(accept_encoding)
+        best = None
+        for name in self.encodings:
+            q = accepted.get(name, accepted.get('*', 0.0))
+            if q > 0 and (best is None or q > best[1]):
+                best = name, q
+        return best and best[0]
+
+    def compress(self, body, encoding):
+        if encoding=='br':
+            return brotli.compress(body, quality=min(11, self.level + 2))
+        return _gzip(body, self.level)
+
+    def __call__(self, request, response, body):
+        '''
+        Return body compressed if possible, and update response headers.
+        :param request:
+        :param response:
+        :param body:
+        :return:
+        '''
+        if isinstance(body, (list, tuple)):
+            if not all(isinstance(b, str) for b in body):
+                return body
+            body = ''.join(body)
+        elif not isinstance(body, str):
+            return body
+        if response.status_code not in (200, 304) or response.header('Content-Encoding'):
+            return body
+        content_type = (response.content_type or '').split(';')[0].strip().lower()
+        if content_type not in self.content_types:
+            return body
+        _add_vary(response, 'Accept-Encoding')
+        if response.status_code!=200 or len(body) < self.min_size:
+            return body
+        encoding = self.negotiate(request.header('Accept-Encoding'))
+        if encoding is None:
+            return body
+        body = self.compress(body, encoding)
+        response.set_header('Content-Encoding', encoding)
+        response.content_length = len(body)
+        etag = response.header('ETag')
+        if etag and etag.endswith('"'):
+            # another representation, another entity tag
+            response.set_header('ETag', '%s-%s"' % (etag[:-1], encoding))
+        return body
+
+def _add_vary(response, name):
+    vary = response.header('Vary')
+    if not vary:
+        response.set_header('Vary', name)
+    elif name.lower() not in [v.strip().lower() for v in vary.split(',')]:
+        response.set_header('Vary', '%s, %s' % (vary, name))
+
 def _default_error_handler(e, start_response, is_debug):
     if isinstance(e, HttpError):
         logging.info('HttpError: %s' % e.status)
@@ -927,6 +1435,196 @@ def view(path):
         return _wrapper
     return _decorator
 
+class ResponseCache(object):
+    '''
+    Cache of whole responses with tag based invalidation.
+
+    Each tag has a version kept in the backend. An entry records the versions its
+    tags had before the response was rendered, and is stale once any of them
+    changed, so a tag invalidated while rendering expires the entry too. A tag
+    version evicted from the backend is recreated with a new value, so eviction
+    only causes misses.
+
+    >>> rc = ResponseCache()
+    >>> versions = rc.tag_versions(['blog:1'])
+    >>> rc.invalidate('blog:1')
+    >>> rc.set('page', 'rendered before invalidation', 60, ['blog:1'], versions)
+    >>> rc.get('page') is None
+    True
+    >>> rc.set('page', 'rendered after invalidation', 60, ['blog:1'], rc.tag_versions(['blog:1']))
+    >>> rc.get('page')
+    'rendered after invalidation'
+    '''
+    def __init__(self, backend=None):
+        '''
+        Init a ResponseCache.
+        :param backend: a transwarp.cache.CacheBackend, default to an LRUCache
+        '''
+        self.backend = backend or LRUCache(max_size=1000, ttl=None)
+
+    def tag_versions(self, tags):
+        '''
+        Return current versions of tags, read them before rendering the response to set.
+        :param tags:
+        :return:
+        '''
+        versions = []
+        for tag in tags:
+            key = 'tag:%s' % tag
+            v = self.backend.get(key)
+            if v is None:
+                v = uuid.uuid4().hex
+                self.backend.set(key, v, None)
+            versions.append(v)
+        return versions
+
+    def get(self, key):
+        '''
+        Return cached (status, headers, body), or None if not cached or stale.
+        :param key:
+        :return:
+        '''
+        entry = self.backend.get('page:%s' % key)
+        if entry is None:
+            return None
+        tags, versions, response = entry
+        if tags and self.tag_versions(tags)!=versions:
+            self.backend.delete('page:%s' % key)
+            return None
+        return response
+
+    def set(self, key, response, ttl, tags=(), versions=None):
+        '''
+        Cache (status, headers, body) for ttl seconds, until any tag is invalidated.
+        :param key:
+        :param response:
+        :param ttl:
+        :param tags:
+        :param versions: tag_versions(tags) read before rendering the response, default
+                         to current versions, then an invalidation while rendering is lost
+        :return:
+        '''
+        tags = tuple(tags)
+        if versions is None:
+            versions = self.tag_versions(tags)
+        self.backend.set('page:%s' % key, (tags, list(versions), response), ttl)
+
+    def invalidate(self, *tags):
+        '''
+        Expire all responses cached with any of tags.
+        :param tags:
+        :return:
+        '''
+        for tag in tags:
+            self.backend.delete('tag:%s' % tag)
+
+    def clear(self):
+        self.backend.clear()
+
+response_cache = ResponseCache()
+
+def invalidate_tags(*tags):
+    '''
+    Expire responses cached by @cached with any of tags.
+    :param tags:
+    :return:
+    '''
+    response_cache.invalidate(*tags)
+
+def _response_cache_key(query, vary_user):
+    request = ctx.request
+    L = ['GET' if request.request_method=='HEAD' else request.request_method, request.path_info]
+    for name in query:
+        value = request.get(name)
+        L.append(name if value is None else '%s=%s' % (name, _to_str(value)))
+    if vary_user:
+        user = getattr(request, 'user', None)
+        L.append('user=%s' % (user.id if user else ''))
+    return hashlib.md5('\n'.join(_to_str(x) for x in L)).hexdigest()
+
+def cached(ttl=60, query=(), vary_user=False, tags=(), cache=None):
+    '''
+    A @cached decorator that caches the status, headers and body of a GET response.
+    Put it above @view or @api so the cached body is the rendered one:
+
+    @cached(300, vary_user=True, tags=('blog:{0}', ))
+    @view('blog.html')
+    @get('/blog/:blog_id')
+    def blog(blog_id):
+        ...
+
+    The key is made of method, path, values of the query parameters and the id of
+    ctx.request.user if vary_user. Only responses of status 200 without cookies
+    are stored. Use invalidate_tags() to expire them before ttl.
+    :param ttl: seconds to keep the response
+    :param query: names of the query parameters making different responses
+    :param vary_user: set True if the response depends on the user signed in
+    :param tags: tags as str formatted by handler args like 'blog:{0}', or a
+                 function returns tags by handler args
+    :param cache: a ResponseCache, default to response_cache
+    :return:
+    '''
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kw):
+            if ctx.request.request_method not in ('GET', 'HEAD'):
+                return func(*args, **kw)
+            rc = cache or response_cache
+            key = _response_cache_key(query, vary_user)
+            hit = rc.get(key)
+            response = ctx.response
+            if hit is not None:
+                status, headers, body = hit
+                response.status = status
+                for name, value in headers:
+                    response.set_header(name, value)
+                etag = response.header('ETag')
+                if etag and ctx.request.not_modified(etag):
+                    response.status = 304
+                    return ''
+                return body
+            # read versions first, a tag invalidated while rendering expires the entry:
+            entry_tags = tags(*args) if callable(tags) else [t.format(*args) for t in tags]
+            versions = rc.tag_versions(entry_tags)
+            # the response is shared by all requests, so it must not be made of
+            # data from a lagging replica written before the tags were invalidated:
+            with read_primary():
+                r = func(*args, **kw)
+            if isinstance(r, Template):
+                r = ctx.application.template_engine(r.template_name, r.model)
+            if isinstance(r, unicode):
+                r = r.encode('utf-8')
+            if not isinstance(r, str) or response.status_code!=200 or hasattr(response, '_cookies'):
+                return r
+            headers = [(k, v) for k, v in response.headers if k not in ('Set-Cookie', 'X-Powered-By')]
+            rc.set(key, (response.status, headers, r), ttl, entry_tags, versions)
+            return r
+        return _wrapper
+    return _decorator
+
+def cache_control(value):
+    '''
+    A @cache_control decorator that sets the Cache-Control header of response,
+    unless the handler set one. Put it below @cached so the header is cached too.
+
+    @cache_control('no-cache')
+    @api
+    @get('/api/comments')
+    def api_get_comments():
+        ...
+    :param value: e.g. 'no-cache' or 'public, max-age=60'
+    :return:
+    '''
+    def _decorator(func):
+        @functools.wraps(func)
+        def _wrapper(*args, **kw):
+            r = func(*args, **kw)
+            if not ctx.response.header('Cache-Control'):
+                ctx.response.set_header('Cache-Control', value)
+            return r
+        return _wrapper
+    return _decorator
+
 _RE_INTERCEPTROR_STARTS_WITH = re.compile(r'^([^\*\?]+)\*?$')
 _RE_INTERCEPTROR_ENDS_WITH = re.compile(r'^\*([^\*\?]+)$')
 
@@ -939,6 +1637,38 @@ def _build_pattern_fn(pattern):
         return lambda p: p.endswith(m.group(1))
     raise ValueError('Invalid pattern definition in interceptor.')
 
+_RE_ROUTE_PLACEHOLDER = re.compile(r'\:[a-zA-Z_]\w*|\*$')
+
+def _build_route_pattern_fn(pattern):
+    '''
+    Build fn(route_path) that tells if the interceptor applies to the requests of
+    a route: True for all of them, False for none, None if it depends on the
+    request path, e.g. pattern '/manage/blogs*' and route '/manage/:page'.
+    '''
+    m = _RE_INTERCEPTROR_STARTS_WITH.match(pattern)
+    if m:
+        prefix = m.group(1)
+        def _starts_with(path):
+            literals = _RE_ROUTE_PLACEHOLDER.split(path)
+            if len(literals)==1:
+                return path.startswith(prefix)
+            if literals[0].startswith(prefix):
+                return True
+            return None if prefix.startswith(literals[0]) else False
+        return _starts_with
+    m = _RE_INTERCEPTROR_ENDS_WITH.match(pattern)
+    if m:
+        suffix = m.group(1)
+        def _ends_with(path):
+            literals = _RE_ROUTE_PLACEHOLDER.split(path)
+            if len(literals)==1:
+                return path.endswith(suffix)
+            if literals[-1].endswith(suffix):
+                return True
+            return None if suffix.endswith(literals[-1]) else False
+        return _ends_with
+    raise ValueError('Invalid pattern definition in interceptor.')
+
 def interceptor(pattern='/'):
     '''
     An @interceptor decorator.
@@ -947,9 +1677,46 @@ def interceptor(pattern='/'):
     '''
     def _decorator(func):
         func.__interceptor__ = _build_pattern_fn(pattern)
+        func.__interceptor_route__ = _build_route_pattern_fn(pattern)
         return func
     return _decorator
 
+def _build_route_interceptor_fn(func, next, always):
+    '''
+    Wrap next(*args) of a route with interceptor func, which checks the request
+    path only if the route alone can not decide.
+    '''
+    if always:
+        def _wrapper(*args):
+            return func(lambda: next(*args))
+    else:
+        def _wrapper(*args):
+            if func.__interceptor__(ctx.request.path_info):
+                return func(lambda: next(*args))
+            return next(*args)
+    return _wrapper
+
+def _build_route_chain(route, *interceptors):
+    '''
+    Build the interceptor chain of a route, which skips interceptors never
+    matching the route and calls route(*args) at last.
+    :param route:
+    :param interceptors:
+    :return:
+    '''
+    L = list(interceptors)
+    L.reverse()
+    fn = route
+    for f in L:
+        if hasattr(f, '__interceptor_route__'):
+            applies = f.__interceptor_route__(route.path)
+        else:
+            applies = None
+        if applies is False:
+            continue
+        fn = _build_route_interceptor_fn(f, fn, applies)
+    return fn
+
 def _build_interceptor_fn(func, next):
     def _wrapper():
         if func.__interceptor__(ctx.request.path_info):
@@ -1005,12 +1772,9 @@ class WSGIApplication(object):
 
         self._interceptors = []
         self._template_engine = None
+        self._compressor = None
 
-        self._get_static = {}
-        self._post_static = {}
-
-        self._get_dynamic = []
-        self._post_dynamic = []
+        self._routes = []
 
     def _check_not_running(self):
         if self._running:
@@ -1025,6 +1789,20 @@ class WSGIApplication(object):
         self._check_not_running()
         self._template_engine = engine
 
+    @property
+    def compressor(self):
+        return self._compressor
+
+    @compressor.setter
+    def compressor(self, compressor):
+        '''
+        Set a Compressor to compress responses, None to disable.
+        :param compressor:
+        :return:
+        '''
+        self._check_not_running()
+        self._compressor = compressor
+
     def add_module(self, mod):
         self._check_not_running()
         m = mod if type(mod)==types.ModuleType else _load_module(mod)
@@ -1037,16 +1815,7 @@ class WSGIApplication(object):
     def add_url(self, func):
         self._check_not_running()
         route = Route(func)
-        if route.is_static:
-            if route.method=='GET':
-                self._get_static[route.path] = route
-            if route.method=='POST':
-                self._post_static[route.path] = route
-        else:
-            if route.method=='GET':
-                self._get_dynamic.append(route)
-            if route.method=='POST':
-                self._post_dynamic.append(route)
+        self._routes.append(route)
         logging.info('Add route: %s' % str(route))
 
     def add_interceptor(self, func):
@@ -1054,11 +1823,15 @@ class WSGIApplication(object):
         self._interceptors.append(func)
         logging.info('Add interceptor: %s' % str(func))
 
-    def run(self, port=9000, host='127.0.0.1'):
-        from wsgiref.simple_server import make_server
+    def run(self, port=9000, host='127.0.0.1', debug=True, **kw):
+        '''
+        Serve the application with transwarp.server until SIGTERM or SIGINT.
+        Pass workers=N to pre-fork N worker processes, and threads=N for threads per process,
+        see server.Server for other options.
+        '''
+        import server
         logging.info('application (%s) will start at %s:%s...' % (self._document_root, host, port))
-        server = make_server(host, port, self.get_wsgi_application(debug=True))
-        server.serve_forever()
+        server.serve(self.get_wsgi_application(debug=debug), host, port, **kw)
 
     def get_wsgi_application(self, debug=False):
         '''
@@ -1066,36 +1839,31 @@ class WSGIApplication(object):
         :return:
         '''
         self._check_not_running()
-        if debug:
-            self._get_dynamic.append(StaticFileRoute())
+        routes = list(self._routes)
+        if self._document_root:
+            routes.append(StaticFileRoute())
+        router = Router()
+        chains = {}
+        for route in routes:
+            router.add(route)
+            chains[route] = _build_route_chain(route, *self._interceptors)
         self._running = True
 
-        _application = Dict(document_root=self._document_root)
-
-        def fn_route():
-            request_method = ctx.request.request_method
-            path_info = ctx.request.path_info
-            if request_method == 'GET':
-                fn = self._get_static.get(path_info, None)
-                if fn:
-                    return fn()
-                for fn in self._get_dynamic:
-                    args = fn.match(path_info)
-                    if args:
-                        return fn(*args)
-                raise  notfound()
-            if request_method == 'POST':
-                fn = self._post_static.get(path_info, None)
-                if fn:
-                    return fn()
-                for fn in self._post_dynamic:
-                    args = fn.match(path_info)
-                    if args:
-                        return fn(*args)
-                raise notfound()
-            raise badrequest()
+        _application = Dict(document_root=self._document_root, template_engine=self._template_engine)
+
+        def fn_error():
+            raise ctx.request._route_error
+
+        # no route: interceptors still run, e.g. to redirect to signin.
+        fallback = _build_interceptor_chain(fn_error, *self._interceptors)
 
-        fn_exec = _build_interceptor_chain(fn_route, *self._interceptors)
+        def fn_exec():
+            try:
+                route, args = router.match(ctx.request.request_method, ctx.request.path_info)
+            except HttpError, e:
+                ctx.request._route_error = e
+                return fallback()
+            return chains[route](*args)
 
         def wsgi(env, start_response):
             ctx.application = _application
@@ -1109,7 +1877,19 @@ class WSGIApplication(object):
                     r = r.encode('utf-8')
                 if r is None:
                     r = []
+                if self._compressor:
+                    r = self._compressor(ctx.request, response, r)
+                if env['REQUEST_METHOD']=='HEAD' and response.content_length is None and response.status_code not in (204, 304):
+                    # the body is dropped, send the length of GET so the server can keep the connection
+                    if isinstance(r, str):
+                        response.content_length = len(r)
+                    elif isinstance(r, (list, tuple)) and all(isinstance(x, str) for x in r):
+                        response.content_length = sum(len(x) for x in r)
                 start_response(response.status, response.headers)
+                if env['REQUEST_METHOD']=='HEAD':
+                    if hasattr(r, 'close'):
+                        r.close()
+                    return []
                 return r
             except RedirectError, e:
                 response.set_header('Location', e.location)
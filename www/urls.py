@@ -3,14 +3,18 @@
 
 import os, re, time, base64, hashlib, logging
 
-import markdown2
-from transwarp.web import get, post, ctx, view, interceptor, seeother, notfound
+from transwarp.web import get, post, ctx, view, cached, cache_control, interceptor, seeother, notfound
 
-from apis import api, Page, APIError, APIValueError, APIPermissionError, APIResourceNotFoundError
+from apis import api, Page, CursorPage, APIError, APIValueError, APIPermissionError, APIResourceNotFoundError
 from models import User, Blog, Comment
+from transwarp.orm import identity_map
+from transwarp import db, adb
+from sessions import session_cache
+from renderer import markdown_cache
 from config import configs
 
 _COOKIE_NAME = 'awesession'
+_PIN_COOKIE_NAME = 'awepin'
 _COOKIE_KEY = configs.session.secret
 
 def _get_page_index():
@@ -21,6 +25,19 @@ def _get_page_index():
         pass
     return page_index
 
+def _get_page_cursor():
+    '''
+    Return the cursor of keyset pagination, '' for the first page, or None if not in cursor mode.
+    '''
+    return ctx.request.get('cursor', None)
+
+def _find_page(model, cursor, **kw):
+    try:
+        items, next_cursor = model.find_page(after=cursor or None, **kw)
+    except ValueError:
+        raise APIValueError('cursor', 'invalid cursor.')
+    return items, CursorPage(next_cursor)
+
 def make_signed_cookie(id, password, max_age):
     expires = str(int(time.time() + (max_age or 86400)))
     L = [id, expires, hashlib.md5('%s-%s-%s-%s' % (id, password, expires, _COOKIE_KEY)).hexdigest()]
@@ -28,17 +45,22 @@ def make_signed_cookie(id, password, max_age):
 
 def parse_signed_cookie(cookie_str):
     try:
+        d = session_cache.get(cookie_str)
+        if d is not None:
+            return User(**d)
         L = cookie_str.split('-')
         if len(L) != 3:
             return None
         id, expires, md5 = L
         if int(expires) < time.time():
             return None
+        generation = session_cache.generation(id)
         user = User.get(id)
         if user is None:
             return None
         if md5 != hashlib.md5('%s-%s-%s-%s' % (id, user.password, expires, _COOKIE_KEY)).hexdigest():
             return None
+        session_cache.put(cookie_str, user.id, dict(user), int(expires), generation)
         return user
     except:
         return None
@@ -49,6 +71,30 @@ def check_admin():
         return
     raise APIPermissionError('No permission.')
 
+@interceptor('/')
+def identity_interceptor(next):
+    with identity_map():
+        return next()
+
+@interceptor('/')
+def primary_pin_interceptor(next):
+    '''
+    Keep reading from the primary db for a short while after a client writes, so it sees
+    its own writes from lagging replicas even if the next request goes to another process.
+    '''
+    try:
+        until = float(ctx.request.cookie(_PIN_COOKIE_NAME, '0'))
+    except ValueError:
+        until = 0
+    db.pin_primary(until)
+    try:
+        return next()
+    finally:
+        pinned_until = db.primary_pinned_until()
+        if pinned_until > until:
+            ctx.response.set_cookie(_PIN_COOKIE_NAME, '%.3f' % pinned_until, max_age=int(pinned_until - time.time()) + 1)
+        db.pin_primary(0)
+
 @interceptor('/')
 def user_interceptor(next):
     logging.info('try to bind user from session cookie...')
@@ -81,6 +127,7 @@ def manage_interceptor(next):
 #     users = User.find_all()
 #     return dict(users=users)
 
+@cached(60, tags=('blog-list', ))
 @view('blogs.html')
 @get('/')
 def index():
@@ -89,15 +136,17 @@ def index():
     user = User.find_first('where email=?', 'admin@example.com')
     return dict(blogs=blogs, user=user)
 
+@cached(300, vary_user=True, tags=('blog:{0}', ))
 @view('blog.html')
 @get('/blog/:blog_id')
 def blog(blog_id):
-    blog = Blog.get(blog_id)
+    blog = Blog.get(blog_id, columns='*')
     if blog is None:
         raise notfound()
-    blog.html_content = markdown2.markdown(blog.content)
-    comments = Comment.find_by('where blog_id=? order by created_at desc limit 1000', blog_id)
-    return dict(blog=blog, comments=comments, user=ctx.request.user)
+    # load comments in a db thread while rendering markdown:
+    comments = adb.submit(Comment.find_by, 'where blog_id=? order by created_at desc limit 1000', blog_id)
+    blog.html_content = markdown_cache.render(blog.content)
+    return dict(blog=blog, comments=comments.result(), user=ctx.request.user)
 
 @view('signin.html')
 @get('/signin')
@@ -126,8 +175,13 @@ def authenticate():
     max_age = 604800 if remember=='true' else None
     cookie = make_signed_cookie(user.id, user.password, max_age)
     ctx.response.set_cookie(_COOKIE_NAME, cookie, max_age=max_age)
-    user.password = '******'
-    return user
+    return _mask_password(user)
+
+def _mask_password(user):
+    '''
+    Return a copy of user without password, the instance itself may be shared by the identity map.
+    '''
+    return dict(user, password='******')
 
 _RE_EMAIL = re.compile(r'^[a-z0-9\.\-\_]+\@[a-z0-9\-\_]+(\.[a-z0-9\-\_]+){1,4}$')
 _RE_MD5 = re.compile(r'^[0-9a-f]{32}$')
@@ -160,10 +214,13 @@ def register_user():
 def register():
     return dict()
 
-def _get_blogs_by_page():
+def _get_blogs_by_page(columns=None):
+    cursor = _get_page_cursor()
+    if cursor is not None:
+        return _find_page(Blog, cursor, columns=columns)
     total = Blog.count_all()
     page = Page(total, _get_page_index())
-    blogs = Blog.find_by('order by created_at desc limit ?,?', page.offset, page.limit)
+    blogs = Blog.find_by('order by created_at desc limit ?,?', page.offset, page.limit, columns=columns)
     return blogs, page
 
 @get('/manage/')
@@ -187,7 +244,7 @@ def manage_blogs_create():
 @view('manage_blog_edit.html')
 @get('/manage/blogs/edit/:blog_id')
 def manage_blogs_edit(blog_id):
-    blog = Blog.get(blog_id)
+    blog = Blog.get(blog_id, columns='*')
     if blog is None:
         raise notfound()
     return dict(id=blog.id, name=blog.name, summary=blog.summary, content=blog.content, action='/api/blogs/%s' % blog_id, redirect='/manage/blogs', user=ctx.request.user)
@@ -196,20 +253,22 @@ def manage_blogs_edit(blog_id):
 def manage_users():
     return dict(page_index=_get_page_index(), user=ctx.request.user)
 
+@cached(60, query=('page', 'cursor', 'format'), tags=('blog-list', ))
+@cache_control('no-cache')
 @api
 @get('/api/blogs')
 def api_get_blogs():
     format = ctx.request.get('format', '')
-    blogs, page = _get_blogs_by_page()
+    blogs, page = _get_blogs_by_page('*' if format=='html' else None)
     if format=='html':
         for blog in blogs:
-            blog.content = markdown2.markdown(blog.content)
+            blog.content = markdown_cache.render(blog.content)
     return dict(blogs=blogs, page=page)
 
 @api
 @get('/api/blogs/:blog_id')
 def api_get_blog(blog_id):
-    blog = Blog.get(blog_id)
+    blog = Blog.get(blog_id, columns='*')
     if blog:
         return blog
     raise APIResourceNotFoundError('Blog')
@@ -231,6 +290,7 @@ def api_create_blog():
     user = ctx.request.user
     blog = Blog(user_id=user.id, user_name=user.name, name=name, summary=summary, content=content)
     blog.insert()
+    markdown_cache.render(blog.content)
     return blog
 
 @api
@@ -254,6 +314,7 @@ def api_update_blog(blog_id):
     blog.summary = summary
     blog.content = content
     blog.update()
+    markdown_cache.render(blog.content)
     return blog
 
 @api
@@ -292,9 +353,14 @@ def api_delete_comment(comment_id):
     comment.delete()
     return dict(id=comment_id)
 
+@cache_control('no-cache')
 @api
 @get('/api/comments')
 def api_get_comments():
+    cursor = _get_page_cursor()
+    if cursor is not None:
+        comments, page = _find_page(Comment, cursor)
+        return dict(comments=comments, page=page)
     total = Comment.count_all()
     page = Page(total, _get_page_index())
     comments =Comment.find_by('order by created_at desc limit ?,?', page.offset, page.limit)
@@ -303,9 +369,11 @@ def api_get_comments():
 @api
 @get('/api/users')
 def api_get_users():
-    total = User.count_all()
-    page = Page(total, _get_page_index())
-    users = User.find_by('order by created_at desc limit ?,?', page.offset, page.limit)
-    for u in users:
-        u.password = '******'
-    return dict(users=users, page=page)
\ No newline at end of file
+    cursor = _get_page_cursor()
+    if cursor is not None:
+        users, page = _find_page(User, cursor)
+    else:
+        total = User.count_all()
+        page = Page(total, _get_page_index())
+        users = User.find_by('order by created_at desc limit ?,?', page.offset, page.limit)
+    return dict(users=[_mask_password(u) for u in users], page=page)
\ No newline at end of file
@@ -11,7 +11,7 @@ import os, time
 from datetime import datetime
 
 from transwarp import db
-from transwarp.web import WSGIApplication, Jinja2TemplateEngine
+from transwarp.web import WSGIApplication, Jinja2TemplateEngine, Compressor
 
 from config import configs
 
@@ -39,13 +39,17 @@ template_engine.add_filter('datetime', datetime_filter)
 
 wsgi.template_engine = template_engine
 
+wsgi.compressor = Compressor(**configs.compression)
+
 import urls
 
+wsgi.add_interceptor(urls.identity_interceptor)
+wsgi.add_interceptor(urls.primary_pin_interceptor)
 wsgi.add_interceptor(urls.user_interceptor)
 wsgi.add_interceptor(urls.manage_interceptor)
 wsgi.add_module(urls)
 
 if __name__ == '__main__':
-    wsgi.run(9001, host='0.0.0.0')
+    wsgi.run(9001, host='0.0.0.0', **configs.server)
 else:
     application = wsgi.get_wsgi_application()
\ No newline at end of file